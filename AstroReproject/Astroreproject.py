@@ -4,74 +4,730 @@
 # reproject the data (2d/3d) into regular system. Practically, it just
 # rotate the data for you.
 # Updated on 2021.8.27 by Fengwei
+#
+# Run it on one or many cubes in a single process,
+#   python3 Astroreproject.py cube1.fits cube2.fits "survey/*.fits"
+# or import it and use derotate_header(), reproject_moment0() and
+# reproject_cube() directly.
+#
+# With `--moments`, moment 0/1/2, peak and rms maps of the derotated
+# cube are accumulated while the cube is written, in a single pass.
+# `--float32` keeps 32-bit JCMT data in float32 from input to output.
+# `--cache DIR` keeps the derotated headers and pixel maps on disk, so
+# other lines from the same footprint skip the coordinate work.
+# `--method nearest|exact|adaptive` swaps the bilinear interpolation for
+# a cheap quick-look or a flux-conserving algorithm, and `--method
+# rotate` just rotates each channel plane without any WCS transforms.
+# Only the footprint of the input on the derotated grid is computed;
+# `--crop` also drops the blank corners from the products, and
+# `--keep-nan` keeps blank moment-0 pixels blank rather than zero.
+#
+# For cubes too large for memory, run with `--chunk N` to reproject N
+# channels at a time straight into a FITS file on disk, and add
+# `--workers N` to share the channel blocks out to N processes.
+#
+# When the spectral axis is left untouched (the usual case here), the
+# 2-D pixel mapping is computed once and applied to every channel.
 ######################################################################
 
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from astropy import units as u
 import numpy as np
 from astropy.io import fits
 from astropy import wcs
+from astropy.wcs.utils import pixel_to_pixel
+from scipy import ndimage
 from spectral_cube import SpectralCube as sc
-from reproject import reproject_interp
-
-input = './BG081_HCN(4-3).cut20.fits' # input data to be reprojected
-hcn = sc.read(input,hdu=0) # JCMT HARPS HCN(4-3) data cube
-w0 = wcs.WCS(hcn.header)
-
-hcn_m0 = hcn.moment(order=0) # produce momzero map, a 2-D data
-hdr = hcn_m0.hdu.header # get a 2-D header
-w1 = wcs.WCS(hcn_m0.hdu.header)
-hcn_m0 = np.nan_to_num(hcn_m0.hdu.data).astype(float) # nan to zero
-hcn_m0_hdu = fits.ImageHDU(data = hcn_m0, header = w1.to_header())
-
-newhdr = fits.Header()
-newhdr['SIMPLE'] = (True, 'conforms to FITS standard')
-newhdr['BITPIX'] = (-64, 'array data type')
-newhdr['NAXIS'] = 2
-cosphi = abs(hdr['PC1_1'])
-sinphi = abs(hdr['PC1_2'])
-oldpix = hdr['NAXIS1']
-newpix = oldpix * (cosphi + sinphi) / np.sqrt(cosphi**2 + sinphi**2)
-delta = np.sqrt(cosphi**2 + sinphi**2)
-newhdr['NAXIS1'] = int(newpix) + 1
-newhdr['NAXIS2'] = int(newpix) + 1
-newhdr['CRPIX1'] = (int(newpix) + 1)/2
-newhdr['CRPIX2'] = (int(newpix) + 1)/2
-newhdr['CDELT1'] = -delta
-newhdr['CDELT2'] = delta
-newhdr['CUNIT1'] = ('deg','Units of coordinate increment and value')
-newhdr['CUNIT2'] = 'deg'
-newhdr['CTYPE1'] = 'RA---TAN'
-newhdr['CTYPE2'] = 'DEC--TAN'
-
-# find the coordinate of the center point
-ORPIX1 = hdr['CRPIX1']
-ORPIX2 = hdr['CRPIX2']
-newhdr['CRVAL1'] = hdr['CRVAL1'] + (-delta)  * (oldpix/2+0.5-hdr['CRPIX1'])
-newhdr['CRVAL2'] = hdr['CRVAL2'] + delta  * (oldpix/2+0.5-hdr['CRPIX2'])
-newhdr['TELESCOP'] = ('JCMT', 'Name of Telescope')
-newhdr['RADESYS'] = ('FK5','Equatorial coordinate system')
-newhdr['EQUINOX'] = 2000.0
-newhdr['BUNIT'] = 'K km/s'
-
-hcn_m0_rp, footprint = reproject_interp(hcn_m0_hdu, newhdr)
-# print(newhdr)
-hcnm0_rp_hdu = fits.PrimaryHDU(hcn_m0_rp)
-hcnm0_rp_hdu.header = newhdr
-hcnm0_rp_hdu.writeto('HCN(4-3)_MomZero_rp.fits', overwrite=True)
-
-w2 = wcs.WCS(hcn.header)
-newhdr['NAXIS'] = 3
-w3 = wcs.WCS(newhdr, naxis=3)
-w3._naxis = [0,0,0]
-w3.wcs.ctype = ['RA---TAN',  'DEC--TAN',  'VRAD' ]
-w3.wcs.crval = [newhdr['CRVAL1'], newhdr['CRVAL2'], w2.wcs.crval[2]]
-w3.wcs.crpix = [newhdr['CRPIX1'], newhdr['CRPIX2'], w2.wcs.crpix[2]]
-w3.wcs.cdelt = [newhdr['CDELT1'], newhdr['CDELT2'], w2.wcs.pc[2,2]]
-w3.wcs.pc = np.identity(3)
-
-nx = newhdr['NAXIS1']
-ny = newhdr['NAXIS2']
-nv = len(hcn.spectral_axis)
-_data, _fp = reproject_interp(hcn.hdu, output_projection=w3, shape_out=(nv,ny,nx))
-hcn_rp = sc(data=_data,wcs=w3).with_spectral_unit(u.km/u.s)
-hcn_rp.write('HCN(4-3)_cube_rp.fits',overwrite=True)
+from reproject import reproject_interp, reproject_exact, reproject_adaptive
+
+METHODS = ('interp', 'nearest', 'exact', 'adaptive', 'rotate') # see reproject_2d()
+
+def new_fits(filename, header, shape, bitpix=-64):
+    '''
+    Create a FITS file of the given shape (numpy order) on disk without
+    holding its data in memory. The data part is left blank (zeros).
+    '''
+    hdr = fits.PrimaryHDU().header
+    hdr['BITPIX'] = bitpix
+    hdr['NAXIS'] = len(shape)
+    for i, n in enumerate(shape[::-1]):
+        hdr['NAXIS%d' % (i + 1)] = n
+    for card in header.cards:
+        if card.keyword not in hdr and card.keyword not in ('SIMPLE', 'EXTEND'):
+            hdr.append(card)
+    hdr.tofile(filename, overwrite=True)
+    nbytes = int(np.prod(shape)) * abs(bitpix) // 8
+    nbytes = (nbytes + 2879) // 2880 * 2880 # FITS data is padded to 2880-byte blocks
+    with open(filename, 'rb+') as fobj:
+        fobj.seek(len(hdr.tostring()) + nbytes - 1)
+        fobj.write(b'\0')
+
+def is_spatial_only(wcs_in, wcs_out):
+    '''
+    Check whether two 3-D WCS share the same spectral axis and differ only
+    in their (unmixed) celestial axes, so that channel i of the output is
+    a 2-D reprojection of channel i of the input.
+    '''
+    if wcs_in.naxis != 3 or wcs_out.naxis != 3:
+        return False
+    wcs_in.wcs.set() # make sure wcs.spec is up to date
+    wcs_out.wcs.set()
+    s_in, s_out = wcs_in.wcs.spec, wcs_out.wcs.spec
+    if s_in != 2 or s_out != 2:
+        return False
+    pc_in, pc_out = wcs_in.wcs.get_pc(), wcs_out.wcs.get_pc()
+    for pc in (pc_in, pc_out):
+        if np.any(pc[2, :2] != 0) or np.any(pc[:2, 2] != 0):
+            return False
+    return (wcs_in.wcs.ctype[2] == wcs_out.wcs.ctype[2]
+            and np.isclose(wcs_in.wcs.crval[2], wcs_out.wcs.crval[2])
+            and np.isclose(wcs_in.wcs.crpix[2], wcs_out.wcs.crpix[2])
+            and np.isclose(wcs_in.wcs.cdelt[2] * pc_in[2, 2], wcs_out.wcs.cdelt[2] * pc_out[2, 2]))
+
+def footprint_slices(wcs_in, wcs_out, shape_in, shape_out, pad=1):
+    '''
+    Bounding box (slice_y, slice_x) of the pixels of the celestial grid of
+    wcs_out (shape_out) that fall on the input image of wcs_in (shape_in =
+    (ny, nx)), grown by pad pixels. Only the edge of the input image is
+    transformed, so this is cheap compared to the reprojection itself.
+    '''
+    ny, nx = shape_in
+    ex, ey = np.arange(-0.5, nx, 0.5), np.arange(-0.5, ny, 0.5) # outer edges of the border pixels
+    x = np.concatenate([ex, ex, np.full(len(ey), -0.5), np.full(len(ey), nx - 0.5)])
+    y = np.concatenate([np.full(len(ex), -0.5), np.full(len(ex), ny - 0.5), ey, ey])
+    xo, yo = pixel_to_pixel(wcs_in.celestial, wcs_out.celestial, x, y)
+    if not (np.all(np.isfinite(xo)) and np.all(np.isfinite(yo))):
+        return slice(0, shape_out[0]), slice(0, shape_out[1])
+    x0 = min(max(int(np.ceil(xo.min() - 1e-9)) - pad, 0), shape_out[1])
+    x1 = max(min(int(np.floor(xo.max() + 1e-9)) + pad + 1, shape_out[1]), x0)
+    y0 = min(max(int(np.ceil(yo.min() - 1e-9)) - pad, 0), shape_out[0])
+    y1 = max(min(int(np.floor(yo.max() + 1e-9)) + pad + 1, shape_out[0]), y0)
+    return slice(y0, y1), slice(x0, x1)
+
+def crop_header(header, slices):
+    '''
+    2-D header of the sub-grid (slice_y, slice_x) of a header, e.g. from
+    footprint_slices().
+    '''
+    sy, sx = slices
+    hdr = header.copy()
+    hdr['NAXIS1'] = sx.stop - sx.start
+    hdr['NAXIS2'] = sy.stop - sy.start
+    hdr['CRPIX1'] = header['CRPIX1'] - sx.start
+    hdr['CRPIX2'] = header['CRPIX2'] - sy.start
+    return hdr
+
+def pixel_map(wcs_in, wcs_out, shape_in, shape_out, method='interp'):
+    '''
+    Compute the bilinear interpolation map from the celestial grid of
+    wcs_in (shape_in = (ny, nx)) onto that of wcs_out (shape_out). Returns
+    (index, fx, fy, valid): the flat index of the lower-left input pixel,
+    the fractional offsets and a mask of output pixels that fall on the
+    input. As in reproject, points in the outer half of a border pixel are
+    moved to its centre. With method='nearest', index is the nearest input
+    pixel and fx, fy are None. Only the footprint_slices() of the output
+    go through the WCS transform.
+    '''
+    ny, nx = shape_in
+    sy, sx = footprint_slices(wcs_in, wcs_out, shape_in, shape_out)
+    x = np.full(tuple(shape_out), -1.) # off the input
+    y = np.full(tuple(shape_out), -1.)
+    yy, xx = np.mgrid[sy, sx]
+    x[sy, sx], y[sy, sx] = pixel_to_pixel(wcs_out.celestial, wcs_in.celestial,
+                                          xx.astype(float), yy.astype(float))
+    x = np.where((x < 0) & (x >= -0.5), 0, x)
+    x = np.where((x >= nx - 1) & (x < nx - 0.5), nx - 1, x)
+    y = np.where((y < 0) & (y >= -0.5), 0, y)
+    y = np.where((y >= ny - 1) & (y < ny - 0.5), ny - 1, y)
+    valid = (x >= 0) & (x <= nx - 1) & (y >= 0) & (y <= ny - 1)
+    if method == 'nearest':
+        xn = np.floor(np.where(valid, x, 0) + 0.5).astype(np.intp)
+        yn = np.floor(np.where(valid, y, 0) + 0.5).astype(np.intp)
+        return yn * nx + xn, None, None, valid
+    x0 = np.clip(np.floor(np.where(valid, x, 0)), 0, nx - 2).astype(np.intp)
+    y0 = np.clip(np.floor(np.where(valid, y, 0)), 0, ny - 2).astype(np.intp)
+    fx = np.where(valid, x - x0, 0.)
+    fy = np.where(valid, y - y0, 0.)
+    return y0 * nx + x0, fx, fy, valid
+
+def apply_map(data, pmap, dtype=np.float64):
+    '''
+    Interpolate every channel of data (nv, ny, nx) with a map from
+    pixel_map() in one vectorized gather. The result and all temporary
+    arrays are of the given dtype.
+    '''
+    index, fx, fy, valid = pmap
+    nx = data.shape[-1]
+    flat = data.reshape(len(data), -1)
+    idx = index[valid]
+    if fx is None: # nearest neighbour
+        out = np.full((len(data),) + index.shape, np.nan, dtype=dtype)
+        out[:, valid] = flat[:, idx]
+        return out
+    wx, wy = fx[valid].astype(dtype), fy[valid].astype(dtype)
+    out = np.full((len(data),) + index.shape, np.nan, dtype=dtype)
+    out[:, valid] = (flat[:, idx] * ((1 - wx) * (1 - wy)) + flat[:, idx + 1] * (wx * (1 - wy))
+                     + flat[:, idx + nx] * ((1 - wx) * wy) + flat[:, idx + nx + 1] * (wx * wy))
+    return out
+
+def rotation_map(wcs_in, wcs_out, shape_in, shape_out):
+    '''
+    When the celestial grids of wcs_in (shape_in = (ny, nx)) and wcs_out
+    (shape_out) share the projection and its tangent point, the output
+    pixels map onto the input ones by an exact affine transform (a pure
+    rotation for equal pixel scales). Returns (matrix, offset, valid) for
+    apply_rotation(), computed from the header values alone, or raises
+    ValueError if the grids are not related that way.
+    '''
+    c_in, c_out = wcs_in.celestial, wcs_out.celestial
+    if (list(c_in.wcs.ctype) != list(c_out.wcs.ctype)
+            or not np.allclose(c_in.wcs.crval, c_out.wcs.crval, rtol=0, atol=1e-10)
+            or not np.isclose(c_in.wcs.lonpole, c_out.wcs.lonpole)):
+        raise ValueError("the rotation engine needs the same projection and tangent point "
+                         "for input and output (see derotate_header(keep_tangent_point=True))")
+    # pixel -> intermediate world coordinates is linear, CD (p - CRPIX), on both grids
+    m = np.linalg.solve(c_in.pixel_scale_matrix, c_out.pixel_scale_matrix)
+    offset = (c_in.wcs.crpix - 1) - m @ (c_out.wcs.crpix - 1)
+    matrix, offset = m[::-1, ::-1], offset[::-1] # to numpy (y, x) order
+    yy, xx = np.mgrid[:shape_out[0], :shape_out[1]]
+    y = matrix[0, 0] * yy + matrix[0, 1] * xx + offset[0]
+    x = matrix[1, 0] * yy + matrix[1, 1] * xx + offset[1]
+    ny, nx = shape_in
+    valid = (x >= -0.5) & (x < nx - 0.5) & (y >= -0.5) & (y < ny - 0.5) # as in pixel_map()
+    return matrix, offset, valid
+
+def apply_rotation(data, rmap, dtype=np.float64):
+    '''
+    Rotate every channel plane of data (nv, ny, nx) with the affine
+    transform from rotation_map(), by bilinear interpolation. Only the
+    bounding box of the valid output pixels is computed.
+    '''
+    matrix, offset, valid = rmap
+    out = np.full((len(data),) + valid.shape, np.nan, dtype=dtype)
+    rows, cols = np.flatnonzero(valid.any(1)), np.flatnonzero(valid.any(0))
+    if len(rows) == 0:
+        return out
+    sy, sx = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+    sub_offset = offset + matrix @ np.array([sy.start, sx.start])
+    sub_shape = (sy.stop - sy.start, sx.stop - sx.start)
+    for i in range(len(data)):
+        # mode='nearest' gives the outer half of the border pixels their value
+        out[i, sy, sx] = ndimage.affine_transform(data[i].astype(dtype), matrix, sub_offset,
+                                                  output_shape=sub_shape, order=1,
+                                                  mode='nearest', prefilter=False)
+    out[:, ~valid] = np.nan
+    return out
+
+def reproject_2d(data, wcs_in, wcs_out, shape_out, method='interp'):
+    '''
+    Reproject an image, or a stack of images (..., ny, nx) sharing the
+    celestial WCS wcs_in, with one of METHODS: 'interp' (bilinear),
+    'nearest' (nearest neighbour, cheapest), 'exact' (spherical polygon
+    overlap), 'adaptive' (anti-aliased) or 'rotate' (bilinear, through
+    rotation_map() instead of WCS transforms, for grids sharing their
+    tangent point). Returns the reprojected data. Only the
+    footprint_slices() of the output grid are computed, the rest is NaN.
+    'exact' and 'adaptive' conserve the total flux: blank (NaN) input
+    pixels and the area outside the input count as zero flux, and output
+    pixels partly off the input are weighted by their covered fraction.
+    Output pixels with no input at all are NaN.
+    '''
+    if method not in METHODS:
+        raise ValueError("method must be one of %s, not %r" % (', '.join(METHODS), method))
+    shape_out = tuple(shape_out)
+    wcs_out = wcs_out if isinstance(wcs_out, wcs.WCS) else wcs.WCS(wcs_out)
+    if method == 'rotate':
+        rmap = rotation_map(wcs_in, wcs_out, data.shape[-2:], shape_out[-2:])
+        return apply_rotation(data.reshape((-1,) + data.shape[-2:]), rmap).reshape(shape_out)
+    out = np.full(shape_out, np.nan)
+    # the adaptive kernel reaches a little beyond the input image
+    sy, sx = footprint_slices(wcs_in, wcs_out, data.shape[-2:], shape_out[-2:],
+                              pad=2 if method == 'adaptive' else 1)
+    sub_wcs = wcs_out.celestial.slice((sy, sx))
+    sub_shape = shape_out[:-2] + (sy.stop - sy.start, sx.stop - sx.start)
+    if 0 in sub_shape:
+        return out
+    if method == 'interp':
+        sub, _fp = reproject_interp((data, wcs_in), sub_wcs, shape_out=sub_shape)
+    elif method == 'nearest':
+        sub, _fp = reproject_interp((data, wcs_in), sub_wcs, shape_out=sub_shape, order='nearest-neighbor')
+    elif method == 'exact':
+        sub, fp = reproject_exact((np.nan_to_num(data), wcs_in), sub_wcs, shape_out=sub_shape)
+        sub = np.where(fp > 0, sub * fp, np.nan)
+    elif method == 'adaptive':
+        sub, _fp = reproject_adaptive((data, wcs_in), sub_wcs, shape_out=sub_shape, conserve_flux=True,
+                                      boundary_mode='constant', boundary_fill_value=0,
+                                      bad_value_mode='constant', bad_fill_value=0)
+    out[..., sy, sx] = sub
+    return out
+
+def channel_velocity(cube_wcs, pix):
+    '''
+    Velocity in km/s at the given channels (pixel positions) of a 3-D WCS.
+    '''
+    spec = cube_wcs.sub([wcs.WCSSUB_SPECTRAL])
+    v = spec.pixel_to_world_values(np.asarray(pix, dtype=float))
+    return (v * u.Unit(spec.wcs.cunit[0])).to_value(u.km/u.s)
+
+def moment_sums(block, velo):
+    '''
+    Per-pixel sums over the channels of a block (nv, ny, nx) with channel
+    velocities velo, from which moment_maps() builds the maps. The sums of
+    consecutive blocks are combined with add_sums().
+    '''
+    finite = np.isfinite(block)
+    data = np.where(finite, block, 0)
+    v = velo[:, None, None].astype(data.dtype) # no float64 copies of a float32 block
+    f8 = np.float64 # but always accumulate in double precision
+    return {'n': finite.sum(0), 's0': data.sum(0, dtype=f8), 's1': (data * v).sum(0, dtype=f8),
+            's2': (data * v * v).sum(0, dtype=f8), 'sq': (data * data).sum(0, dtype=f8),
+            'peak': np.where(finite, block, -np.inf).max(0)}
+
+def add_sums(total, part):
+    if total is None:
+        return part
+    for key in total:
+        if key == 'peak':
+            total[key] = np.maximum(total[key], part[key])
+        else:
+            total[key] = total[key] + part[key]
+    return total
+
+def moment_maps(sums, dv, vref=0.):
+    '''
+    Moment 0, 1 and 2, peak and rms maps from the sums of moment_sums(),
+    following spectral_cube: mom0 = sum(I |dv|), mom1 = sum(I v)/sum(I) and
+    mom2 is the intensity-weighted velocity variance. The velocities given
+    to moment_sums() are relative to vref, which keeps mom2 accurate.
+    Pixels without any valid channel are NaN.
+    '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        blank = sums['n'] == 0
+        m1 = sums['s1'] / sums['s0']
+        maps = {'mom0': sums['s0'] * abs(dv), # the channel width, whichever way the axis runs
+                'mom1': m1 + vref,
+                'mom2': sums['s2'] / sums['s0'] - m1**2,
+                'peak': sums['peak'].astype(float),
+                'rms': np.sqrt(sums['sq'] / sums['n'])}
+    for key in maps:
+        maps[key][blank] = np.nan
+    return maps
+
+def cube_header(wcs_out):
+    '''
+    Header of a derotated cube with the 3-D WCS wcs_out, as written by
+    reproject_cube(): through spectral_cube, with the spectral axis in km/s
+    '''
+    return sc(data=np.zeros((1, 1, 1)), wcs=wcs_out).with_spectral_unit(u.km / u.s).header
+
+def reproject_block(filename, wcs_out, output_name, v0, v1, pmap=None, velo=None, method='interp'):
+    '''
+    Reproject channels v0:v1 of the input cube into the same channels of
+    an existing output FITS file (see reproject_cube_chunked), in the
+    data type of that file. If the channel velocities velo are given,
+    also return the moment_sums() of the reprojected block.
+    '''
+    hdul_in = fits.open(filename, memmap=True)
+    data_in = hdul_in[0].data
+    hdul_out = fits.open(output_name, mode='update', memmap=True)
+    data_out = hdul_out[0].data
+    if method == 'rotate':
+        data_out[v0:v1] = apply_rotation(data_in[v0:v1], pmap, np.dtype(data_out.dtype.name))
+    elif pmap is not None:
+        data_out[v0:v1] = apply_map(data_in[v0:v1], pmap, np.dtype(data_out.dtype.name))
+    else:
+        wcs_in = wcs.WCS(hdul_in[0].header)
+        data_out[v0:v1] = reproject_2d(data_in[v0:v1], wcs_in.celestial, wcs_out.celestial,
+                                       (v1 - v0,) + data_out.shape[1:], method)
+    sums = None
+    if velo is not None:
+        sums = moment_sums(data_out[v0:v1], velo)
+    hdul_out.close()
+    hdul_in.close()
+    return v0, v1, sums
+
+def reproject_cube_chunked(filename, wcs_out, shape_out, output_name, chunk=64, workers=1,
+                           moments=False, dtype=np.float64, pmap=None, method='interp',
+                           verbose=True):
+    '''
+    Reproject a data cube block by block along the spectral axis, writing
+    each block into a memory-mapped output FITS file. Only one block of the
+    input and output is held in memory per process, so peak memory is set
+    by `chunk` rather than by the cube size. Channel i of the output must
+    correspond to channel i of the input, i.e. a purely spatial reprojection
+    (is_spatial_only()), otherwise a ValueError is raised.
+    With workers > 1 the blocks are shared out to a pool of processes; each
+    block is computed exactly as in the serial case, so the output file is
+    byte-identical.
+    With moments=True the moment_maps() of the output cube are built from
+    the blocks as they are written, without another pass over the cube,
+    and returned as a dict of 2-D arrays.
+    The input is read memory-mapped and the output is written directly
+    into its memory-mapped file as dtype (e.g. np.float32 for JCMT data).
+    A pixel_map() computed before (e.g. from the cache) may be given.
+    method is one of METHODS (see reproject_2d). The output header is that
+    of reproject_cube() (cube_header()).
+    '''
+    with fits.open(filename, memmap=True) as hdul_in:
+        shape_in = hdul_in[0].data.shape
+        wcs_in = wcs.WCS(hdul_in[0].header)
+    if not is_spatial_only(wcs_in, wcs_out):
+        raise ValueError("the chunked reprojection needs a purely spatial reprojection")
+    new_fits(output_name, cube_header(wcs_out), shape_out, bitpix=-8 * np.dtype(dtype).itemsize)
+    nv = shape_out[0]
+    if method == 'rotate':
+        pmap = rotation_map(wcs_in, wcs_out, shape_in[1:], shape_out[1:])
+    elif method not in ('interp', 'nearest'):
+        pmap = None
+    elif pmap is None:
+        pmap = pixel_map(wcs_in, wcs_out, shape_in[1:], shape_out[1:], method)
+    velo = None
+    if moments:
+        vref = channel_velocity(wcs_out, [nv // 2])[0]
+        velo = channel_velocity(wcs_out, np.arange(nv)) - vref
+    blocks = [(v0, min(v0 + chunk, nv)) for v0 in range(0, nv, chunk)]
+    block_sums = {}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(reproject_block, filename, wcs_out, output_name, v0, v1, pmap,
+                                None if velo is None else velo[v0:v1], method)
+                    for v0, v1 in blocks]
+            for job in as_completed(jobs):
+                v0, v1, block_sums[v0] = job.result()
+                if verbose:
+                    print("Reprojected channels %d-%d of %d" % (v0, v1 - 1, nv), flush=True)
+    else:
+        for v0, v1 in blocks:
+            _v0, _v1, block_sums[v0] = reproject_block(filename, wcs_out, output_name, v0, v1, pmap,
+                                                       None if velo is None else velo[v0:v1], method)
+            if verbose:
+                print("Reprojected channels %d-%d of %d" % (v0, v1 - 1, nv), flush=True)
+    if not moments:
+        return None
+    sums = None
+    for v0, v1 in blocks: # always combine in channel order, whatever the number of workers
+        sums = add_sums(sums, block_sums[v0])
+    dv = np.diff(channel_velocity(wcs_out, [0, 1]))[0]
+    return moment_maps(sums, dv, vref)
+
+def derotate_header(hdr, keep_tangent_point=False):
+    '''
+    Build the 2-D header of the regular RA/Dec grid that covers a rotated
+    JCMT map, from the (2-D or 3-D) header of the rotated data. With
+    keep_tangent_point=True the same grid is referenced to the tangent
+    point (CRVAL) of the input instead of its centre, so that the two are
+    related by an exact rotation (see rotation_map).
+    '''
+    newhdr = fits.Header()
+    newhdr['SIMPLE'] = (True, 'conforms to FITS standard')
+    newhdr['BITPIX'] = (-64, 'array data type')
+    newhdr['NAXIS'] = 2
+    cosphi = abs(hdr['PC1_1'])
+    sinphi = abs(hdr['PC1_2'])
+    oldpix = hdr['NAXIS1']
+    newpix = oldpix * (cosphi + sinphi) / np.sqrt(cosphi**2 + sinphi**2)
+    delta = np.sqrt(cosphi**2 + sinphi**2)
+    newhdr['NAXIS1'] = int(newpix) + 1
+    newhdr['NAXIS2'] = int(newpix) + 1
+    newhdr['CRPIX1'] = (int(newpix) + 1)/2
+    newhdr['CRPIX2'] = (int(newpix) + 1)/2
+    newhdr['CDELT1'] = -delta
+    newhdr['CDELT2'] = delta
+    newhdr['CUNIT1'] = ('deg','Units of coordinate increment and value')
+    newhdr['CUNIT2'] = 'deg'
+    newhdr['CTYPE1'] = 'RA---TAN'
+    newhdr['CTYPE2'] = 'DEC--TAN'
+
+    # find the coordinate of the center point
+    newhdr['CRVAL1'] = hdr['CRVAL1'] + (-delta)  * (oldpix/2+0.5-hdr['CRPIX1'])
+    newhdr['CRVAL2'] = hdr['CRVAL2'] + delta  * (oldpix/2+0.5-hdr['CRPIX2'])
+    if keep_tangent_point:
+        newhdr['CRPIX1'] = (int(newpix) + 1)/2 - (oldpix/2+0.5-hdr['CRPIX1'])
+        newhdr['CRPIX2'] = (int(newpix) + 1)/2 - (oldpix/2+0.5-hdr['CRPIX2'])
+        newhdr['CRVAL1'] = hdr['CRVAL1']
+        newhdr['CRVAL2'] = hdr['CRVAL2']
+    newhdr['TELESCOP'] = ('JCMT', 'Name of Telescope')
+    newhdr['RADESYS'] = ('FK5','Equatorial coordinate system')
+    newhdr['EQUINOX'] = 2000.0
+    return newhdr
+
+def derotate_wcs(cube_wcs, header):
+    '''
+    3-D WCS of the derotated cube: the celestial axes of the 2-D header
+    from derotate_header() plus the spectral axis of the input cube.
+    '''
+    newhdr = header.copy()
+    newhdr['NAXIS'] = 3
+    w3 = wcs.WCS(newhdr, naxis=3)
+    w3._naxis = [0,0,0]
+    w3.wcs.ctype = ['RA---TAN',  'DEC--TAN',  'VRAD' ]
+    w3.wcs.crval = [newhdr['CRVAL1'], newhdr['CRVAL2'], cube_wcs.wcs.crval[2]]
+    w3.wcs.crpix = [newhdr['CRPIX1'], newhdr['CRPIX2'], cube_wcs.wcs.crpix[2]]
+    w3.wcs.cdelt = [newhdr['CDELT1'], newhdr['CDELT2'], cube_wcs.pixel_scale_matrix[2,2]] # CDELT3 * PC3_3
+    w3.wcs.pc = np.identity(3)
+    w3.wcs.restfrq = cube_wcs.wcs.restfrq # needed to convert the VRAD axis
+    w3.wcs.specsys = cube_wcs.wcs.specsys
+    w3.wcs.set()
+    return w3
+
+def reproject_moment0(cube, header=None, dtype=np.float64, method='interp', keep_nan=False):
+    '''
+    Moment-0 map of a SpectralCube, reprojected onto the derotated grid
+    (header from derotate_header(), computed if not given) with one of
+    METHODS. Blank pixels of the map are set to zero first, unless
+    keep_nan=True. Returns a PrimaryHDU with data of the given dtype.
+    '''
+    m0 = cube.moment(order=0) # produce momzero map, a 2-D data
+    hdr = m0.hdu.header # get a 2-D header
+    w1 = wcs.WCS(hdr)
+    data = m0.hdu.data if keep_nan else np.nan_to_num(m0.hdu.data)
+    m0_hdu = fits.ImageHDU(data = data.astype(dtype), header = w1.to_header())
+    newhdr = derotate_header(hdr, keep_tangent_point=(method == 'rotate')) if header is None else header.copy()
+    newhdr['BITPIX'] = -8 * np.dtype(dtype).itemsize
+    newhdr['BUNIT'] = 'K km/s'
+    m0_rp = reproject_2d(m0_hdu.data, wcs.WCS(m0_hdu.header), newhdr,
+                         (newhdr['NAXIS2'], newhdr['NAXIS1']), method)
+    m0_rp_hdu = fits.PrimaryHDU(m0_rp.astype(dtype, copy=False))
+    m0_rp_hdu.header = newhdr
+    return m0_rp_hdu
+
+def reproject_cube(cube, header, moments=False, dtype=np.float64, pmap=None, method='interp'):
+    '''
+    Reproject a SpectralCube in memory onto the derotated grid given by
+    the 2-D header from derotate_header(), with one of METHODS. Returns a
+    SpectralCube of the given dtype, or with moments=True the SpectralCube
+    and its moment_maps(). A pixel_map() computed before may be given.
+    '''
+    w2 = wcs.WCS(cube.header)
+    w3 = derotate_wcs(w2, header)
+    shape_out = (cube.shape[0], header['NAXIS2'], header['NAXIS1'])
+    spatial_only = is_spatial_only(w2, w3)
+    if method in ('exact', 'adaptive', 'rotate'):
+        if not spatial_only:
+            raise ValueError("method %r needs a purely spatial reprojection" % method)
+        if method == 'rotate':
+            _data = apply_rotation(cube.hdu.data, rotation_map(w2, w3, cube.shape[1:], shape_out[1:]), dtype)
+        else:
+            _data = reproject_2d(cube.hdu.data, w2.celestial, w3.celestial, shape_out, method)
+    elif spatial_only:
+        if pmap is None:
+            pmap = pixel_map(w2, w3, cube.shape[1:], shape_out[1:], method)
+        _data = apply_map(cube.hdu.data, pmap, dtype)
+    else:
+        order = 'nearest-neighbor' if method == 'nearest' else 'bilinear'
+        _data, _fp = reproject_interp(cube.hdu, output_projection=w3, shape_out=shape_out, order=order)
+    _data = _data.astype(dtype, copy=False)
+    cube_rp = sc(data=_data,wcs=w3).with_spectral_unit(u.km/u.s)
+    if not moments:
+        return cube_rp
+    vref = channel_velocity(w3, [shape_out[0] // 2])[0]
+    velo = channel_velocity(w3, np.arange(shape_out[0])) - vref
+    dv = np.diff(channel_velocity(w3, [0, 1]))[0]
+    return cube_rp, moment_maps(moment_sums(_data, velo), dv, vref)
+
+def moment_hdus(maps, header, bunit='K', dtype=np.float64):
+    '''
+    PrimaryHDUs of the moment_maps() on the derotated grid (header from
+    derotate_header()); bunit is the unit of the cube.
+    '''
+    units = {'mom0': bunit + ' km/s', 'mom1': 'km/s', 'mom2': 'km2/s2', 'peak': bunit, 'rms': bunit}
+    hdus = {}
+    for key in maps:
+        hdr = header.copy()
+        hdr['BITPIX'] = -8 * np.dtype(dtype).itemsize
+        hdr['BUNIT'] = units[key]
+        hdus[key] = fits.PrimaryHDU(maps[key].astype(dtype), header=hdr)
+    return hdus
+
+CACHE_VERSION = 4 # bump when derotate_header() or pixel_map() change
+
+def cache_store(cache_dir, key, max_bytes, **arrays):
+    '''
+    Save arrays as <key>.npz in cache_dir, then delete the least recently
+    used entries until the cache is no larger than max_bytes.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, os.path.join(cache_dir, key + '.npz')) # atomic, so runs can share a cache
+    entries = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith('.npz')]
+    entries.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(f) for f in entries)
+    while total > max_bytes and len(entries) > 1:
+        oldest = entries.pop(0)
+        total -= os.path.getsize(oldest)
+        os.remove(oldest)
+
+def cache_load(cache_dir, key):
+    '''
+    Arrays saved by cache_store() under key, or None. A hit marks the
+    entry as recently used.
+    '''
+    filename = os.path.join(cache_dir, key + '.npz')
+    try:
+        with np.load(filename) as entry:
+            arrays = dict(entry)
+        os.utime(filename)
+    except (OSError, ValueError):
+        return None
+    return arrays
+
+def derotate_cached(hdr, shape_in, cache_dir, max_bytes=2**30, method='interp'):
+    '''
+    derotate_header() of a cube header and the pixel_map() from its grid
+    (shape_in = (ny, nx)) onto the derotated one, taken from the on-disk
+    cache in cache_dir when possible. Entries are keyed by a hash of the
+    celestial projection (CTYPE, CRVAL, CRPIX, CDELT, PC/CD, LONPOLE/LATPOLE,
+    RADESYS/EQUINOX) and shape of the input (and the method), so every line
+    observed on the same footprint shares one entry, whatever its rest
+    frequency or date. The other methods use no pixel map, so only the
+    header is cached for them.
+    '''
+    w_in = wcs.WCS(hdr)
+    use_map = method in ('interp', 'nearest')
+    cel = w_in.celestial.wcs
+    # only what derotate_header() and pixel_map() depend on: the rest frequency,
+    # dates and observatory position differ between lines of one footprint
+    footprint = (list(cel.ctype), list(cel.cunit), cel.crval.tolist(), cel.crpix.tolist(), cel.cdelt.tolist(),
+                 cel.get_pc().tolist(), cel.lonpole, cel.latpole, cel.radesys, cel.equinox)
+    key = '%d %r %s %s' % (CACHE_VERSION, footprint, tuple(shape_in), method)
+    key = hashlib.sha1(key.encode()).hexdigest()
+    entry = cache_load(cache_dir, key)
+    if entry is not None:
+        pmap = None
+        if use_map:
+            pmap = (entry['index'], entry.get('fx'), entry.get('fy'), entry['valid'])
+        return fits.Header.fromstring(str(entry['header'])), pmap
+    newhdr = derotate_header(hdr, keep_tangent_point=(method == 'rotate'))
+    if not use_map:
+        cache_store(cache_dir, key, max_bytes, header=newhdr.tostring())
+        return newhdr, None
+    w3 = derotate_wcs(w_in, newhdr)
+    pmap = pixel_map(w_in, w3, shape_in, (newhdr['NAXIS2'], newhdr['NAXIS1']), method)
+    arrays = {'index': pmap[0], 'valid': pmap[3]}
+    if pmap[1] is not None:
+        arrays.update(fx=pmap[1], fy=pmap[2])
+    cache_store(cache_dir, key, max_bytes, header=newhdr.tostring(), **arrays)
+    return newhdr, pmap
+
+def output_names(filename, outdir=None, products=('MomZero', 'cube')):
+    '''
+    Names of the products for an input file, e.g. for
+    BG081_HCN(4-3).cut20.fits: BG081_HCN(4-3).cut20_MomZero_rp.fits and
+    BG081_HCN(4-3).cut20_cube_rp.fits.
+    '''
+    stem = os.path.basename(filename)
+    if stem.lower().endswith('.fits'):
+        stem = stem[:-5]
+    outdir = os.path.dirname(filename) if outdir is None else outdir
+    return [os.path.join(outdir, '%s_%s_rp.fits' % (stem, product)) for product in products]
+
+def process_file(filename, outdir=None, chunk=None, workers=1, moments=False, dtype=np.float64,
+                 cache_dir=None, cache_size=2**30, method='interp', crop=False, keep_nan=False):
+    '''
+    Derotate one JCMT cube: write its reprojected moment-0 map and cube.
+    With moments=True, the moment 0, 1, 2, peak and rms maps are instead
+    made from the reprojected cube in the same pass that writes it.
+    All products are written as dtype. With a cache_dir, the derotated
+    header and pixel map are reused from earlier runs on the same
+    footprint (see derotate_cached). method is one of METHODS and is used
+    for both the moment-0 map and the cube; with 'rotate' the derotated
+    grid keeps the tangent point of the input. With crop=True, the grid is
+    cut down to the bounding box of the input footprint, dropping the
+    blank corners. keep_nan is passed on to reproject_moment0(). Returns
+    the names of the products.
+    '''
+    cube = sc.read(filename, hdu=0)
+    if cache_dir is None:
+        newhdr, pmap = derotate_header(cube.header, keep_tangent_point=(method == 'rotate')), None
+    else:
+        newhdr, pmap = derotate_cached(cube.header, cube.shape[1:], cache_dir, cache_size, method)
+    if crop:
+        # output pixels partly on the input matter for the flux-conserving methods
+        pad = {'exact': 1, 'adaptive': 2}.get(method, 0)
+        slices = footprint_slices(wcs.WCS(cube.header), wcs.WCS(newhdr), cube.shape[1:],
+                                  (newhdr['NAXIS2'], newhdr['NAXIS1']), pad)
+        newhdr = crop_header(newhdr, slices)
+        if pmap is not None:
+            pmap = tuple(None if a is None else a[slices] for a in pmap)
+    if moments:
+        cube_name, = output_names(filename, outdir, ['cube'])
+    else:
+        m0_name, cube_name = output_names(filename, outdir)
+        reproject_moment0(cube, newhdr, dtype, method, keep_nan).writeto(m0_name, overwrite=True)
+    if chunk is None:
+        cube_rp = reproject_cube(cube, newhdr, moments=moments, dtype=dtype, pmap=pmap,
+                                 method=method)
+        if moments:
+            cube_rp, maps = cube_rp
+        cube_rp.write(cube_name, overwrite=True)
+    else:
+        w3 = derotate_wcs(wcs.WCS(cube.header), newhdr)
+        shape_out = (cube.shape[0], newhdr['NAXIS2'], newhdr['NAXIS1'])
+        maps = reproject_cube_chunked(filename, w3, shape_out, cube_name, chunk=chunk,
+                                      workers=workers, moments=moments, dtype=dtype, pmap=pmap,
+                                      method=method)
+    if not moments:
+        return [m0_name, cube_name]
+    hdus = moment_hdus(maps, newhdr, cube.header.get('BUNIT', 'K'), dtype)
+    names = output_names(filename, outdir, list(hdus))
+    for key, name in zip(hdus, names):
+        hdus[key].writeto(name, overwrite=True)
+    return [cube_name] + names
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rotate JCMT data into the RA/Dec grid.')
+    parser.add_argument('inputs', nargs='*', default=['./BG081_HCN(4-3).cut20.fits'],
+                        help='input cubes or glob patterns, e.g. "*.fits"')
+    parser.add_argument('-o', '--outdir', default=None,
+                        help='directory for the products (default: next to each input)')
+    parser.add_argument('--chunk', type=int, default=None,
+                        help='reproject the cube N channels at a time into a FITS file on disk')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes for the chunked reprojection (implies --chunk 64)')
+    parser.add_argument('--moments', action='store_true',
+                        help='make moment 0/1/2, peak and rms maps in the same pass as the cube')
+    parser.add_argument('--float32', action='store_true',
+                        help='keep the data in float32 and write the cube through a memory map '
+                             '(implies --chunk 64)')
+    parser.add_argument('--method', choices=METHODS, default='interp',
+                        help='interp (bilinear, default), nearest (quick look), the '
+                             'flux-conserving exact or adaptive, or rotate (bilinear, on a grid '
+                             'sharing the tangent point of the input, without WCS transforms)')
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help='reuse derotated headers and pixel maps of the same footprint from DIR')
+    parser.add_argument('--crop', action='store_true',
+                        help='cut the derotated grid down to the footprint of the input')
+    parser.add_argument('--keep-nan', action='store_true',
+                        help='keep blank pixels of the moment-0 map blank instead of zero')
+    parser.add_argument('--cache-size', type=float, default=1024., metavar='MB',
+                        help='maximum size of the cache, oldest entries are removed first')
+    args = parser.parse_args(argv)
+    if args.chunk is None and (args.workers > 1 or args.float32):
+        args.chunk = 64
+    dtype = np.float32 if args.float32 else np.float64
+
+    filenames = []
+    for pattern in args.inputs:
+        found = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        found = [each for each in found if os.path.isfile(each)]
+        if not found:
+            print("No file matches %s" % pattern, file=sys.stderr, flush=True)
+        filenames += found
+    if not filenames:
+        parser.error("no input files")
+    for filename in filenames:
+        names = process_file(filename, args.outdir, args.chunk, args.workers, args.moments, dtype,
+                             args.cache, int(args.cache_size * 2**20), args.method, args.crop,
+                             args.keep_nan)
+        print("%s -> %s" % (filename, ', '.join(names)), flush=True)
+
+if __name__ == '__main__':
+    main()
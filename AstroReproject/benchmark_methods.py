@@ -0,0 +1,71 @@
+######################################################################
+# Benchmark the reprojection methods of Astroreproject.py on the
+# bundled HCN(4-3) cube: runtime of the moment-0 (2D) and cube (3D)
+# paths, and how well each conserves the total flux, i.e. the sum of
+# the data times the pixel solid angle, before and after reprojection.
+# The 3D speedup is against the generic reproject_interp of the whole
+# cube through its 3-D WCS. The moment-0 map fused into the cube pass
+# (moments=True) is checked against the flux of the 2D path; --flip runs
+# everything on the cube with its velocity axis reversed.
+#
+#   python3 benchmark_methods.py [--flip]
+######################################################################
+
+import argparse
+import time
+import numpy as np
+from astropy import wcs
+from astropy.io import fits
+from astropy.wcs.utils import proj_plane_pixel_area
+from spectral_cube import SpectralCube as sc
+from reproject import reproject_interp
+from Astroreproject import METHODS, derotate_header, derotate_wcs, reproject_moment0, reproject_cube
+
+def total_flux(data, celestial_wcs):
+    return np.nansum(data) * proj_plane_pixel_area(celestial_wcs)
+
+def best_time(func, repeat):
+    best = float('inf')
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runtime and flux error of each reprojection method.')
+    parser.add_argument('--input', default='./BG081_HCN(4-3).cut20.fits')
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=list(METHODS))
+    parser.add_argument('--repeat', type=int, default=3, help='keep the best of N runs')
+    parser.add_argument('--flip', action='store_true', help='reverse the velocity axis of the cube first')
+    args = parser.parse_args()
+
+    cube = sc.read(args.input, hdu=0)
+    if args.flip: # same data, channels in the opposite order and a decreasing axis
+        hdu = cube.hdu
+        hdu.header['PC3_3'] = -hdu.header['PC3_3']
+        hdu.header['CRPIX3'] = hdu.header['NAXIS3'] + 1 - hdu.header['CRPIX3']
+        hdu.data = hdu.data[::-1]
+        cube = sc.read(fits.HDUList([hdu]))
+    w_in = wcs.WCS(cube.header).celestial
+    m0 = np.nan_to_num(cube.moment(order=0).hdu.data) # as in reproject_moment0()
+    flux_m0 = total_flux(m0, w_in)
+    flux_cube = total_flux(cube.hdu.data, w_in)
+
+    newhdr = derotate_header(cube.header)
+    w3 = derotate_wcs(wcs.WCS(cube.header), newhdr)
+    shape_out = (cube.shape[0], newhdr['NAXIS2'], newhdr['NAXIS1'])
+    t_generic, _ = best_time(lambda: reproject_interp(cube.hdu, w3, shape_out=shape_out), args.repeat)
+
+    print("%10s %12s %12s %12s %12s %12s %12s" % ('method', '2D time [s]', '2D flux err',
+                                                  '3D time [s]', '3D flux err', '3D speedup', 'mom0 err'))
+    for method in args.methods:
+        newhdr = derotate_header(cube.header, keep_tangent_point=(method == 'rotate'))
+        w_out = wcs.WCS(newhdr)
+        t2, hdu = best_time(lambda: reproject_moment0(cube, newhdr, method=method), args.repeat)
+        t3, cube_rp = best_time(lambda: reproject_cube(cube, newhdr, method=method), args.repeat)
+        err2 = total_flux(hdu.data, w_out) / flux_m0 - 1
+        err3 = total_flux(cube_rp.unmasked_data[:].value, w_out) / flux_cube - 1
+        _cube_rp, maps = reproject_cube(cube, newhdr, moments=True, method=method)
+        errm = total_flux(maps['mom0'], w_out) / total_flux(hdu.data, w_out) - 1 # also catches a flipped sign
+        print("%10s %12.4f %12.2e %12.4f %12.2e %12.1f %12.2e" % (method, t2, err2, t3, err3, t_generic / t3, errm))
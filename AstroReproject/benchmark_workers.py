@@ -0,0 +1,45 @@
+######################################################################
+# Benchmark the chunked reprojection of Astroreproject.py against the
+# number of worker processes, using the bundled HCN(4-3) cube. Every
+# parallel output is checked to be byte-identical to the serial one.
+#
+#   python3 benchmark_workers.py --workers 1 2 4 8 --chunk 64
+######################################################################
+
+import argparse
+import filecmp
+import os
+import time
+from astropy.io import fits
+from astropy import wcs
+from Astroreproject import derotate_header, derotate_wcs, reproject_cube_chunked
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speedup of the chunked reprojection against worker count.')
+    parser.add_argument('--input', default='./BG081_HCN(4-3).cut20.fits')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--chunk', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3, help='keep the best of N runs')
+    args = parser.parse_args()
+    workers = [1] + [n for n in args.workers if n != 1] # the serial run is the reference
+
+    hdr = fits.getheader(args.input)
+    newhdr = derotate_header(hdr)
+    w_out = derotate_wcs(wcs.WCS(hdr), newhdr)
+    shape_out = (hdr['NAXIS3'], newhdr['NAXIS2'], newhdr['NAXIS1'])
+
+    print("%8s %10s %8s %10s" % ('workers', 'time [s]', 'speedup', 'identical'))
+    for n in workers:
+        output_name = 'bench_workers_%d.fits' % n
+        best = float('inf')
+        for i in range(args.repeat):
+            t0 = time.perf_counter()
+            reproject_cube_chunked(args.input, w_out, shape_out, output_name,
+                                   chunk=args.chunk, workers=n, verbose=False)
+            best = min(best, time.perf_counter() - t0)
+        if n == 1:
+            t_serial = best
+        same = filecmp.cmp('bench_workers_1.fits', output_name, shallow=False)
+        print("%8d %10.3f %8.2f %10s" % (n, best, t_serial / best, same))
+    for n in workers:
+        os.remove('bench_workers_%d.fits' % n)
@@ -0,0 +1,126 @@
+######################################################################
+# Benchmark the mosaic pipeline of mosaic2D.py on synthetic fields:
+# square fields of a given size in pixels, on a grid with 20% overlap,
+# each rotated by a random angle up to --rotation degrees, holding a few
+# Gaussian sources on a noisy background. Each backend is run for each
+# number of workers in a fresh process, and the throughput (fields/s and
+# input megapixels/s), the peak memory and the speedup against one
+# worker are reported. Runs offline, the fields are made on the fly.
+#
+#   python3 benchmark_mosaic.py --counts 16 64 --sizes 256 --workers 1 2 4
+#
+# Backends:
+#   montage      make_mosaic(): mProjectQL + mAdd
+#   numpy        make_mosaic(backend='numpy'): mProjectQL + coadd()
+#   memory       mosaic_memory(): reproject_interp + coadd(), no files
+#   incremental  make_mosaic(incremental=True) after one field changed
+######################################################################
+
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from astropy.io import fits
+from astropy import wcs
+
+BACKENDS = ('montage', 'numpy', 'memory', 'incremental')
+
+def make_fields(path, count, size, rotation, pixel=1. / 3600, overlap=0.2, seed=0):
+    '''
+    Write `count` synthetic fields of size x size pixels into path
+    '''
+    rng = np.random.default_rng(seed)
+    ncol = int(np.ceil(np.sqrt(count)))
+    step = size * (1 - overlap) * pixel
+    y, x = np.mgrid[:size, :size]
+    for n in range(count):
+        w = wcs.WCS(naxis=2)
+        w.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+        w.wcs.crval = [83. - (n % ncol) * step / np.cos(np.radians(22.)), 22. + (n // ncol) * step]
+        w.wcs.crpix = [(size + 1) / 2., (size + 1) / 2.]
+        w.wcs.cdelt = [-pixel, pixel]
+        angle = np.radians(rng.uniform(-rotation, rotation))
+        w.wcs.pc = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+        data = rng.normal(0, 0.01, (size, size)) + rng.normal(0, 0.1) # each field its own background
+        for k in range(5):
+            x0, y0, s = rng.uniform(0, size), rng.uniform(0, size), rng.uniform(2, size / 10.)
+            data += np.exp(-((x - x0)**2 + (y - y0)**2) / (2 * s**2))
+        fits.writeto(os.path.join(path, 'field_%04d.fits' % n), data.astype(np.float32), w.to_header(),
+                     overwrite=True)
+
+def run(path, backend, workers):
+    '''
+    Run one backend in path, return the wall time and the peak memory in
+    bytes of this process and the processes it started
+    '''
+    import mosaic2D
+    os.chdir(path)
+    if backend == 'incremental':
+        mosaic2D.make_mosaic(backend='numpy', workers=workers)
+        name = sorted(f for f in os.listdir('.') if f.endswith('.fits'))[0]
+        with fits.open(name) as hdul:
+            data, header = hdul[0].data + 1, hdul[0].header
+        fits.writeto(name, data, header, overwrite=True)
+    t0 = time.perf_counter()
+    if backend == 'montage':
+        mosaic2D.make_mosaic(workers=workers)
+    elif backend == 'numpy':
+        mosaic2D.make_mosaic(backend='numpy', workers=workers)
+    elif backend == 'memory':
+        os.makedirs('final', exist_ok=True)
+        mosaic2D.mosaic_memory('*.fits', 'final/final_mosaic.fits', workers=workers)
+    elif backend == 'incremental':
+        mosaic2D.make_mosaic(backend='numpy', workers=workers, incremental=True)
+    wall = time.perf_counter() - t0
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+    return wall, rss
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput, memory and scaling of the mosaic backends.')
+    parser.add_argument('--counts', type=int, nargs='+', default=[16, 64], help='numbers of fields')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256], help='field sizes in pixels')
+    parser.add_argument('--rotation', type=float, default=30., help='largest rotation of a field in degrees')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeat', type=int, default=1, help='keep the best of N runs')
+    parser.add_argument('--quiet', action='store_true', help='hide the output of the pipeline')
+    args = parser.parse_args()
+
+    lines = []
+    for count in args.counts:
+        for size in args.sizes:
+            path = tempfile.mkdtemp(prefix='bench_mosaic_')
+            make_fields(path, count, size, args.rotation)
+            mpix = count * size * size / 1e6
+            for backend in args.backends:
+                for n in args.workers:
+                    best, rss = float('inf'), 0
+                    for i in range(args.repeat):
+                        # a fresh process for each run, so that its peak memory is its own
+                        with ProcessPoolExecutor(max_workers=1) as pool:
+                            if args.quiet:
+                                devnull = os.open(os.devnull, os.O_WRONLY)
+                                saved = os.dup(1)
+                                os.dup2(devnull, 1)
+                            try:
+                                wall, peak = pool.submit(run, path, backend, n).result()
+                            finally:
+                                if args.quiet:
+                                    os.dup2(saved, 1)
+                                    os.close(devnull)
+                                    os.close(saved)
+                        best, rss = min(best, wall), max(rss, peak)
+                    if n == args.workers[0]:
+                        t_first = best
+                    lines.append("%6d %6d %12s %8d %9.3f %9.1f %9.2f %9.1f %8.2f" % (
+                        count, size, backend, n, best, count / best, mpix / best, rss / 2**20, t_first / best))
+            shutil.rmtree(path)
+
+    print("%6s %6s %12s %8s %9s %9s %9s %9s %8s" % ('fields', 'size', 'backend', 'workers', 'time [s]',
+                                                   'fields/s', 'Mpix/s', 'rss [MB]', 'speedup'))
+    print('\n'.join(lines))
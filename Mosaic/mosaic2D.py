@@ -4,6 +4,23 @@ from MontagePy.main import mGetHdr, mHdr, mImgtbl, mMakeHdr, mProjectQL, mAdd
 import os
 import shutil
 import glob
+import hashlib
+import json
+import tempfile
+import time
+import csv
+import resource
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+from astropy.io import fits
+from astropy import wcs
+from astropy.wcs.utils import pixel_to_pixel
+# pip install reproject, only for make_mosaic(in_memory=True) and mosaic_memory()
+from reproject import reproject_interp
+from reproject.mosaicking import find_optimal_celestial_wcs
+
+COMBINES = ('mean', 'median', 'weighted') # see coadd()
 
 def mkdir(filePath):
     '''
@@ -15,19 +32,831 @@ def mkdir(filePath):
         pass
     os.mkdir(filePath)
 
-def make_mosaic(pre_mosaic_path='./', proj_path = './proj/', final_path = './final/', output_name = 'final_mosaic.fits'):
+PROFILE_FIELDS = ('stage', 'name', 'wall', 'cpu', 'read_bytes', 'written_bytes', 'peak_rss',
+                  'children_peak_rss')
+
+def reset_peak_rss():
+    '''
+    Reset the peak resident memory of this process (VmHWM) to its current
+    resident memory, on Linux. Return False where this is not possible
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    '''
+    Peak resident memory of this process in bytes: VmHWM from
+    /proc/self/status, i.e. since the last reset_peak_rss(), or the peak
+    of the whole process (ru_maxrss) where it does not exist
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def usage(reset=False):
+    '''
+    What this process (and its finished child processes) has used so far:
+    wall clock, CPU time, bytes read and written (from /proc/self/io, 0
+    where it does not exist), peak resident memory (peak_rss()) and that
+    of the largest finished child process, in bytes. With reset=True, the
+    peak resident memory is reset first (reset_peak_rss()), as at the
+    start of a stage
+    '''
+    if reset:
+        reset_peak_rss()
+    io = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                io[key] = int(value)
+    except OSError:
+        pass
+    t = os.times()
+    return {'wall': time.perf_counter(), 'cpu': t.user + t.system + t.children_user + t.children_system,
+            'read_bytes': io.get('rchar', 0), 'written_bytes': io.get('wchar', 0),
+            'peak_rss': peak_rss(),
+            'children_peak_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024}
+
+def usage_record(stage, start, name=''):
+    '''
+    A profile record of a stage, from its usage(reset=True) at the start
+    to now. peak_rss is the peak of the stage on Linux, and of the process
+    so far elsewhere. children_peak_rss is the largest worker process that
+    has finished so far (it cannot be reset), for the stages run in a pool
+    '''
+    end = usage()
+    record = {'stage': stage, 'name': name}
+    for key in ('wall', 'cpu', 'read_bytes', 'written_bytes'):
+        record[key] = end[key] - start[key]
+    record['peak_rss'] = end['peak_rss']
+    record['children_peak_rss'] = end['children_peak_rss']
+    return record
+
+def write_profile(records, filename):
+    '''
+    Write the profile records as JSON, or as CSV if filename ends in .csv
+    '''
+    with open(filename, 'w', newline='') as f:
+        if filename.endswith('.csv'):
+            writer = csv.DictWriter(f, PROFILE_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump(records, f, indent=1)
+
+def print_profile(records, slowest=10):
+    '''
+    Print the time and I/O of each stage and the slowest fields
+    '''
+    print("%-22s %9s %9s %11s %11s %10s %15s" % ('stage', 'wall [s]', 'cpu [s]', 'read [MB]', 'write [MB]',
+                                                 'rss [MB]', 'child rss [MB]'))
+    for r in records:
+        if r['stage'] != 'tile':
+            print("%-22s %9.3f %9.3f %11.1f %11.1f %10.1f %15.1f" % (r['stage'], r['wall'], r['cpu'],
+                                                                  r['read_bytes'] / 2**20, r['written_bytes'] / 2**20,
+                                                                  r['peak_rss'] / 2**20, r['children_peak_rss'] / 2**20))
+    tiles = sorted((r for r in records if r['stage'] == 'tile'), key=lambda r: -r['wall'])
+    if tiles:
+        print("slowest fields (of %d, %.3f s in total):" % (len(tiles), sum(r['wall'] for r in tiles)))
+        for r in tiles[:slowest]:
+            print("  %-40s %9.3f s %9.1f MB read" % (r['name'], r['wall'], r['read_bytes'] / 2**20))
+
+def project_tile(filename, proj_path, template):
+    '''
+    Reproject one pre-mosaic field into the template header, return the
+    field name, the return dict of mProjectQL and a profile record
+    '''
+    start = usage(reset=True)
+    rtn = mProjectQL(filename, proj_path + filename[:-5] + '_proj.fits', template)
+    return filename, rtn, usage_record('tile', start, filename)
+
+def print_progress(done, total, filename, rtn):
+    '''
+    A progress callback for project_tiles(), print one line per field
+    '''
+    print("mProjectQL [%d/%d] %s:  %s" % (done, total, filename, str(rtn)), flush=True)
+
+def project_tiles(filenames, proj_path, template, workers=1, progress=None, records=None):
+    '''
+    Reproject the fields into the template header, `workers` fields at a
+    time in separate processes. After each field, progress(done, total,
+    filename, rtn) is called if given, e.g. print_progress. The profile
+    record of each field is added to records if given. Return a dict of
+    the mProjectQL return dicts, by field name
+    '''
+    rtns = {}
+    def finished(filename, rtn, record):
+        rtns[filename] = rtn
+        if records is not None:
+            records.append(record)
+        if progress is not None:
+            progress(len(rtns), len(filenames), filename, rtn)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(project_tile, each, proj_path, template) for each in filenames]
+            for job in as_completed(jobs):
+                finished(*job.result())
+    else:
+        for each in filenames:
+            finished(*project_tile(each, proj_path, template))
+    return rtns
+
+def file_hash(filename, block=2**20):
+    '''
+    SHA-1 of the content of a file, read in blocks
+    '''
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for data in iter(lambda: f.read(block), b''):
+            sha.update(data)
+    return sha.hexdigest()
+
+def tile_state(filename, template_hash, checksum=False):
+    '''
+    What a reprojected field depends on: the size and modification time
+    (or with checksum=True the content hash) of the field, and the hash
+    of the template header
+    '''
+    st = os.stat(filename)
+    state = {'size': st.st_size, 'template': template_hash}
+    if checksum:
+        state['sha1'] = file_hash(filename)
+    else:
+        state['mtime'] = st.st_mtime_ns
+    return state
+
+def load_manifest(proj_path):
+    '''
+    The manifest of the reprojected fields in proj_path, {} if there is none
+    '''
+    try:
+        with open(proj_path + 'manifest.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(proj_path, manifest):
+    '''
+    Write the manifest into proj_path, replacing the old one at once
+    '''
+    tmp = proj_path + 'manifest.json.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, proj_path + 'manifest.json')
+
+def changed_tiles(filenames, proj_path, template, checksum=False):
+    '''
+    Compare the fields with the manifest in proj_path and delete the
+    reprojected files of fields which are gone. Return the fields that
+    need to be reprojected (new, changed, or with a new template header)
+    and the new manifest
+    '''
+    template_hash = file_hash(template)
+    old = load_manifest(proj_path)
+    manifest, todo = {}, []
+    for each in filenames:
+        manifest[each] = tile_state(each, template_hash, checksum)
+        if old.get(each) != manifest[each] or not os.path.exists(proj_path + each[:-5] + '_proj.fits'):
+            todo.append(each)
+    keep = set(proj_path + each[:-5] + '_proj.fits' for each in filenames)
+    for proj in glob.glob(proj_path + '*_proj.fits'):
+        if proj not in keep: # mImgtbl would pick it up
+            os.remove(proj)
+    return todo, manifest
+
+def read_template(template):
+    '''
+    The template header written by mMakeHdr, as an astropy Header; a
+    Header (e.g. from make_header()) is returned as it is
+    '''
+    if isinstance(template, fits.Header):
+        return template
+    return fits.Header.fromtextfile(template)
+
+def read_header(filename):
+    '''
+    The primary header of a FITS file, None if it cannot be read
+    '''
+    try:
+        return fits.getheader(filename)
+    except (OSError, ValueError):
+        return None
+
+def image_table(filenames, workers=8):
+    '''
+    The image table of the files, like mImgtbl but in memory: only the
+    primary headers are read, `workers` at a time in threads. Return a
+    list with the name, header, shape (ny, nx) and celestial WCS of every
+    file with a 2-D celestial WCS, and a return dict like that of mImgtbl
+    '''
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        headers = list(pool.map(read_header, filenames))
+    table, badfits, badwcs = [], 0, 0
+    for each, hdr in zip(filenames, headers):
+        if hdr is None:
+            badfits += 1
+            continue
+        try:
+            w = wcs.WCS(hdr).celestial
+        except Exception: # any broken WCS counts as bad, as in mImgtbl
+            w = None
+        if w is None or w.naxis != 2:
+            badwcs += 1
+            continue
+        table.append({'fname': each, 'header': hdr, 'shape': (hdr['NAXIS2'], hdr['NAXIS1']), 'wcs': w})
+    return table, {'status': '0', 'count': len(table), 'badfits': badfits, 'badwcs': badwcs}
+
+def make_header(table):
+    '''
+    The template header of the images in an image_table(), like mMakeHdr
+    but in memory, from find_optimal_celestial_wcs of reproject
+    '''
+    w, shape = find_optimal_celestial_wcs([(row['shape'], row['wcs']) for row in table])
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'], header['NAXIS2'] = shape[1], shape[0]
+    header.update(w.to_header())
+    return header
+
+def read_proj(filename):
+    '''
+    A reprojected field (e.g. a _proj.fits from mProjectQL) as (data, header)
+    '''
+    with fits.open(filename) as hdul:
+        return hdul[0].data.astype(np.float64), hdul[0].header
+
+def cutout_slices(header, template_header, pad=1):
     '''
-    
+    Bounding box (slice_y, slice_x) of the template grid covered by an
+    image or cube, grown by pad pixels; None if they do not overlap. Only
+    the edge of the image is transformed
     '''
+    nx, ny = header['NAXIS1'], header['NAXIS2']
+    ex, ey = np.arange(-0.5, nx, 0.5), np.arange(-0.5, ny, 0.5)
+    x = np.concatenate([ex, ex, np.full(len(ey), -0.5), np.full(len(ey), nx - 0.5)])
+    y = np.concatenate([np.full(len(ex), -0.5), np.full(len(ex), ny - 0.5), ey, ey])
+    shape = (template_header['NAXIS2'], template_header['NAXIS1'])
+    xo, yo = pixel_to_pixel(wcs.WCS(header).celestial, wcs.WCS(template_header).celestial, x, y)
+    if not (np.all(np.isfinite(xo)) and np.all(np.isfinite(yo))):
+        return slice(0, shape[0]), slice(0, shape[1])
+    x0, x1 = max(int(np.ceil(xo.min())) - pad, 0), min(int(np.floor(xo.max())) + pad + 1, shape[1])
+    y0, y1 = max(int(np.ceil(yo.min())) - pad, 0), min(int(np.floor(yo.max())) + pad + 1, shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return slice(y0, y1), slice(x0, x1)
+
+def tile_index(boxes, bucket=128):
+    '''
+    Grid-bucket index of boxes (slice_y, slice_x) on the template grid, e.g.
+    from cutout_slices(); None boxes are left out. The grid is cut into
+    bucket x bucket pixel cells, and each cell lists the boxes touching it
+    '''
+    cells = {}
+    for i, box in enumerate(boxes):
+        if box is None:
+            continue
+        sy, sx = box
+        for by in range(sy.start // bucket, (sy.stop - 1) // bucket + 1):
+            for bx in range(sx.start // bucket, (sx.stop - 1) // bucket + 1):
+                cells.setdefault((by, bx), []).append(i)
+    return {'bucket': bucket, 'boxes': list(boxes), 'cells': cells}
+
+def query_index(index, region):
+    '''
+    Numbers of the boxes in a tile_index() that intersect the region
+    (slice_y, slice_x), in increasing order
+    '''
+    bucket, boxes, cells = index['bucket'], index['boxes'], index['cells']
+    sy, sx = region
+    found = set()
+    for by in range(sy.start // bucket, (sy.stop - 1) // bucket + 1):
+        for bx in range(sx.start // bucket, (sx.stop - 1) // bucket + 1):
+            found.update(cells.get((by, bx), ()))
+    return sorted(i for i in found
+                  if boxes[i][0].start < sy.stop and boxes[i][0].stop > sy.start
+                  and boxes[i][1].start < sx.stop and boxes[i][1].stop > sx.start)
+
+def grid_regions(shape, size):
+    '''
+    Cut a grid of the given shape (ny, nx) into size x size regions
+    (slice_y, slice_x), in row order; the last row and column may be smaller
+    '''
+    return [(slice(y0, min(y0 + size, shape[0])), slice(x0, min(x0 + size, shape[1])))
+            for y0 in range(0, shape[0], size) for x0 in range(0, shape[1], size)]
+
+def region_header(header, region):
+    '''
+    The header of a region (slice_y, slice_x) of the template grid
+    '''
+    sy, sx = region
+    hdr = header.copy()
+    hdr['NAXIS1'], hdr['NAXIS2'] = sx.stop - sx.start, sy.stop - sy.start
+    hdr['CRPIX1'] -= sx.start
+    hdr['CRPIX2'] -= sy.start
+    return hdr
+
+def new_header(header, shape, bitpix=-64):
+    '''
+    A primary header for data of the given shape (numpy order), holding
+    the other cards of header
+    '''
+    hdr = fits.PrimaryHDU().header
+    hdr['BITPIX'] = bitpix
+    hdr['NAXIS'] = len(shape)
+    for i, n in enumerate(shape[::-1]):
+        hdr['NAXIS%d' % (i + 1)] = n
+    for card in header.cards:
+        if card.keyword not in hdr and card.keyword not in ('SIMPLE', 'EXTEND'):
+            hdr.append(card)
+    return hdr
+
+def project_memory(filename, template_header, box=None):
+    '''
+    Reproject a field into the template header in memory, with
+    reproject_interp instead of mProjectQL, onto only the box of the
+    template grid it covers (cutout_slices(), computed if not given).
+    Return (data, header) of the cutout, like read_proj()
+    '''
+    with fits.open(filename) as hdul:
+        if box is None:
+            box = cutout_slices(hdul[0].header, template_header)
+        if box is None:
+            return np.zeros((0, 0)), template_header.copy()
+        header = region_header(template_header, box)
+        data, _fp = reproject_interp(hdul[0], wcs.WCS(header),
+                                     shape_out=(header['NAXIS2'], header['NAXIS1']))
+    return data, header
+
+def placement(header, shape, template_header):
+    '''
+    Where an image of the given shape on the template grid lies in the
+    mosaic, as (slices into the mosaic, slices into the image); None if
+    they do not overlap
+    '''
+    x0 = int(round(template_header['CRPIX1'] - header['CRPIX1']))
+    y0 = int(round(template_header['CRPIX2'] - header['CRPIX2']))
+    ny, nx = shape
+    out = (slice(max(y0, 0), min(y0 + ny, template_header['NAXIS2'])),
+           slice(max(x0, 0), min(x0 + nx, template_header['NAXIS1'])))
+    if out[0].start >= out[0].stop or out[1].start >= out[1].stop:
+        return None
+    return out, (slice(out[0].start - y0, out[0].stop - y0), slice(out[1].start - x0, out[1].stop - x0))
+
+def combine_images(images, header, combine='mean', weights=None, memmap=False, rows=256):
+    '''
+    The co-add of coadd(), onto the grid of header. Return the mosaic and
+    the weight (area) arrays
+    '''
+    if combine not in COMBINES:
+        raise ValueError("combine must be one of %s, not %r" % (', '.join(COMBINES), combine))
+    if combine == 'weighted' and weights is None:
+        raise ValueError("combine='weighted' needs the weights")
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    with tempfile.TemporaryFile() as fsum, tempfile.TemporaryFile() as fwt:
+        if memmap:
+            total = np.memmap(fsum, np.float64, 'w+', shape=shape)
+            area = np.memmap(fwt, np.float64, 'w+', shape=shape)
+        else:
+            total, area = np.zeros(shape), np.zeros(shape)
+        placed = []
+        for i, (data, hdr) in enumerate(images):
+            where = placement(hdr, data.shape, header)
+            if where is None:
+                continue
+            out, sub = where
+            data = data[sub]
+            good = np.isfinite(data)
+            if combine == 'median':
+                placed.append((out, data))
+                area[out] += good
+                continue
+            w = 1. if combine == 'mean' else float(weights[i])
+            total[out] += np.where(good, data, 0.) * w
+            area[out] += good * w
+        if combine == 'median':
+            mosaic = np.full(shape, np.nan)
+            index = tile_index([out for out, data in placed], rows)
+            for y0 in range(0, shape[0], rows):
+                y1 = min(y0 + rows, shape[0])
+                band = [placed[i] for i in query_index(index, (slice(y0, y1), slice(0, shape[1])))]
+                if not band:
+                    continue
+                stack = np.full((len(band), y1 - y0, shape[1]), np.nan)
+                for k, (out, data) in enumerate(band):
+                    a, b = max(out[0].start, y0), min(out[0].stop, y1)
+                    stack[k, a - y0:b - y0, out[1]] = data[a - out[0].start:b - out[0].start]
+                covered = area[y0:y1] > 0
+                mosaic[y0:y1][covered] = np.nanmedian(stack[:, covered], axis=0)
+        else:
+            mosaic = np.full(shape, np.nan)
+            np.divide(total, area, out=mosaic, where=area > 0)
+        return mosaic, np.array(area)
+
+def coadd(images, template, output, combine='mean', weights=None, memmap=False, rows=256):
+    '''
+    Co-add images on the template grid with NumPy, instead of mAdd. The
+    template is the file from mMakeHdr or a Header. images is an iterable of (data, header) pairs, e.g. from read_proj()
+    or project_memory(), each a cutout of the template grid. combine is one
+    of COMBINES:
+        'mean'      average of the valid (not NaN) pixels, as mAdd does
+        'median'    median of the valid pixels
+        'weighted'  mean weighted by weights, one number per image
+                    (e.g. 1/rms**2)
+    For 'mean' and 'weighted', the sum and weight arrays are preallocated,
+    in temporary files with memmap=True, and each image is added as it
+    comes. 'median' keeps the images and takes the median `rows` mosaic
+    rows at a time, from only the images that overlap them (tile_index()).
+    Write the mosaic to output and the weight (the number
+    of images for 'mean' and 'median') to output[:-5] + '_area.fits', as
+    mAdd does. Return the mosaic data
+    '''
+    header = read_template(template)
+    mosaic, area = combine_images(images, header, combine, weights, memmap, rows)
+    fits.PrimaryHDU(mosaic, header=header).writeto(output, overwrite=True)
+    fits.PrimaryHDU(area, header=header).writeto(output[:-5] + '_area.fits', overwrite=True)
+    return mosaic
+
+def pair_sums(proj_i, proj_j, template_header):
+    '''
+    Sums for the least-squares fit of a plane a + b*x + c*y to the
+    difference of two reprojected fields where both are valid, with (x, y)
+    the pixel on the template grid counted from its centre:
+    [n, Sx, Sy, Sxx, Sxy, Syy, Sd, Sdx, Sdy]
+    '''
+    data_i, hdr_i = read_proj(proj_i)
+    data_j, hdr_j = read_proj(proj_j)
+    where_i = placement(hdr_i, data_i.shape, template_header)
+    where_j = placement(hdr_j, data_j.shape, template_header)
+    if where_i is None or where_j is None:
+        return np.zeros(9)
+    (oi, si), (oj, sj) = where_i, where_j
+    y0, y1 = max(oi[0].start, oj[0].start), min(oi[0].stop, oj[0].stop)
+    x0, x1 = max(oi[1].start, oj[1].start), min(oi[1].stop, oj[1].stop)
+    if y0 >= y1 or x0 >= x1:
+        return np.zeros(9)
+    d = (data_i[si][y0 - oi[0].start:y1 - oi[0].start, x0 - oi[1].start:x1 - oi[1].start]
+         - data_j[sj][y0 - oj[0].start:y1 - oj[0].start, x0 - oj[1].start:x1 - oj[1].start])
+    yy, xx = np.nonzero(np.isfinite(d))
+    d = d[yy, xx]
+    x = xx + x0 - template_header['NAXIS1'] / 2.
+    y = yy + y0 - template_header['NAXIS2'] / 2.
+    return np.array([len(d), x.sum(), y.sum(), (x * x).sum(), (x * y).sum(), (y * y).sum(),
+                     d.sum(), (d * x).sum(), (d * y).sum()], dtype=np.float64)
+
+def solve_pairs(sums, min_pixels=10):
+    '''
+    The planes (a, b, c) fitted to the differences of all the pairs at once,
+    from their pair_sums() stacked as a (pairs, 9) array. Overlaps too thin
+    to fix a tilt only get an offset; pairs with fewer than min_pixels
+    valid pixels get zero weight. Return the planes and the weights
+    '''
+    sums = np.asarray(sums, dtype=np.float64).reshape(-1, 9)
+    n, sx, sy, sxx, sxy, syy, sd, sdx, sdy = sums.T
+    planes = np.zeros((len(sums), 3))
+    used = n >= min_pixels
+    planes[used, 0] = sd[used] / n[used]
+    m = np.stack([np.stack([n, sx, sy], -1), np.stack([sx, sxx, sxy], -1), np.stack([sy, sxy, syy], -1)], 1)
+    tilt = used.copy()
+    tilt[used] = np.linalg.cond(m[used]) < 1e10 if used.any() else tilt[used]
+    if tilt.any():
+        planes[tilt] = np.linalg.solve(m[tilt], np.stack([sd, sdx, sdy], -1)[tilt][..., None])[..., 0]
+    return planes, np.where(used, n, 0.)
+
+def background_planes(fields, proj_path, template_header, manifest=None, workers=1):
+    '''
+    Background matching of the reprojected fields in proj_path: fit a
+    plane to the difference of every overlapping pair (found with
+    tile_index()), then find the plane of each field that best removes
+    all the differences, weighting each pair by its number of pixels.
+    The pair_sums() are computed in `workers` processes and, with the
+    manifest of make_mosaic, cached per pair in proj_path +
+    'background.json', so that only pairs with a new or changed field are
+    computed again. Return a dict of (a, b, c) by field name, to be
+    removed with subtract_plane()
+    '''
+    names = [proj_path + each[:-5] + '_proj.fits' for each in fields]
+    boxes = []
+    for name in names:
+        hdr = fits.getheader(name)
+        where = placement(hdr, (hdr['NAXIS2'], hdr['NAXIS1']), template_header)
+        boxes.append(None if where is None else where[0])
+    index = tile_index(boxes, 256)
+    pairs = [(i, j) for i in range(len(fields)) if boxes[i] is not None
+             for j in query_index(index, boxes[i]) if j > i]
+    cache_name = proj_path + 'background.json'
+    cache, keys = {}, [None] * len(pairs)
+    if manifest is not None:
+        try:
+            with open(cache_name) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        keys = [hashlib.sha1(json.dumps([manifest[fields[i]], manifest[fields[j]]],
+                                        sort_keys=True).encode()).hexdigest() for i, j in pairs]
+    todo = [k for k, key in enumerate(keys) if key not in cache]
+    print("background: %d overlapping pairs, %d to fit" % (len(pairs), len(todo)), flush=True)
+    args = ([names[pairs[k][0]] for k in todo], [names[pairs[k][1]] for k in todo], repeat(template_header))
+    if workers > 1 and todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            new = list(pool.map(pair_sums, *args, chunksize=max(1, len(todo) // (4 * workers))))
+    else:
+        new = list(map(pair_sums, *args))
+    sums = np.zeros((len(pairs), 9))
+    for k, key in enumerate(keys):
+        if key in cache:
+            sums[k] = cache[key]
+    for k, row in zip(todo, new):
+        sums[k] = row
+    if manifest is not None:
+        tmp = cache_name + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict((key, list(row)) for key, row in zip(keys, sums)), f)
+        os.replace(tmp, cache_name)
+    planes = np.zeros((len(fields), 3))
+    if pairs:
+        diff, n = solve_pairs(sums)
+        # planes[i] - planes[j] = diff for every pair, in the least-squares sense; the minimum-norm
+        # solution has zero mean correction over each connected group of fields
+        w = np.sqrt(n)
+        A = np.zeros((len(pairs), len(fields)))
+        A[np.arange(len(pairs)), [i for i, j in pairs]] = w
+        A[np.arange(len(pairs)), [j for i, j in pairs]] = -w
+        planes = np.linalg.lstsq(A, diff * w[:, None], rcond=None)[0]
+    return dict((each, tuple(plane)) for each, plane in zip(fields, planes))
+
+def subtract_plane(data, header, plane, template_header):
+    '''
+    Remove the background plane (a, b, c) from a reprojected field, with
+    (x, y) counted as in pair_sums(). Return (data, header)
+    '''
+    a, b, c = plane
+    x0 = int(round(template_header['CRPIX1'] - header['CRPIX1'])) - template_header['NAXIS1'] / 2.
+    y0 = int(round(template_header['CRPIX2'] - header['CRPIX2'])) - template_header['NAXIS2'] / 2.
+    y, x = np.ogrid[:data.shape[0], :data.shape[1]]
+    return data - (a + b * (x + x0) + c * (y + y0)), header
+
+def coadd_memory(filenames, headers, header, output, combine='mean', weights=None, workers=1, memmap=False):
+    '''
+    Reproject the fields in memory (project_memory()), `workers` at a time,
+    and co-add them with coadd() onto the template header. Fields off the
+    template are skipped, the others are projected onto their boxes only
+    '''
+    boxes = [cutout_slices(hdr, header) for hdr in headers]
+    used = [i for i, box in enumerate(boxes) if box is not None]
+    if weights is not None:
+        weights = [weights[i] for i in used]
+    fields, boxes = [filenames[i] for i in used], [boxes[i] for i in used]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            images = pool.map(project_memory, fields, repeat(header), boxes)
+            return coadd(images, header, output, combine, weights, memmap)
+    images = (project_memory(each, header, box) for each, box in zip(fields, boxes))
+    return coadd(images, header, output, combine, weights, memmap)
+
+def mosaic_memory(filenames, output, header=None, combine='mean', weights=None, workers=1, memmap=False):
+    '''
+    Mosaic the fields without any file but the output: the image table
+    and template header are made in memory (image_table(), make_header(),
+    unless a header is given) and the fields are reprojected and co-added
+    by coadd_memory(). filenames is a list or a glob pattern, e.g.
+    'survey/*.fits'; weights is a dict by field name. Nothing is written
+    to the working directory, so several mosaics can be made at once in
+    one process. Return the template header
+    '''
+    if isinstance(filenames, str):
+        filenames = sorted(glob.glob(filenames))
+    table, rtn = image_table(filenames, max(workers, 8))
+    print("image_table:  " + str(rtn), flush=True) # update the process
+    if header is None:
+        header = make_header(table)
+    fields = [row['fname'] for row in table]
+    if weights is not None:
+        weights = [weights[each] for each in fields]
+    coadd_memory(fields, [row['header'] for row in table], header, output, combine, weights, workers, memmap)
+    print("coadd (%s):  %d fields" % (combine, len(fields)), flush=True)
+    return header
+
+def make_mosaic(pre_mosaic_path='./', proj_path = './proj/', final_path = './final/', output_name = 'final_mosaic.fits',
+                workers=1, progress=None, incremental=False, checksum=False,
+                backend='montage', combine='mean', weights=None, in_memory=False, memmap=False,
+                background=False, profile=None):
+    '''
+    Mosaic the fields: make the template header, reproject every field
+    into it and co-add them with mAdd. The reprojection runs in `workers`
+    processes at once; progress is passed to project_tiles().
+    With incremental=True, proj_path is kept and only the fields which
+    are new or changed since the last run, according to the manifest in
+    proj_path, are reprojected. By default a field counts as changed when
+    its size or modification time differs, with checksum=True when its
+    content differs.
+    With backend='numpy', the fields are co-added by coadd() instead of
+    mAdd, with combine, memmap and weights (a dict by field name for
+    combine='weighted'). in_memory=True also reprojects the fields in
+    memory (project_memory()), without writing any _proj.fits.
+    background=True matches the backgrounds of the reprojected fields
+    (background_planes()) before the co-add; for mAdd, the corrected
+    fields are written to proj_path + '_bg/'.
+    Return the profile records (usage_record()) of the stages and of each
+    reprojected field; with profile, a .json or .csv file name, they are
+    also written there and summed up by print_profile()
+    '''
+    records = []
+    try:
+        mosaic_stages(records, pre_mosaic_path, proj_path, final_path, output_name, workers, progress,
+                      incremental, checksum, backend, combine, weights, in_memory, memmap, background)
+    finally:
+        if profile is not None:
+            write_profile(records, profile)
+            print_profile(records)
+    return records
+
+def mosaic_stages(records, pre_mosaic_path, proj_path, final_path, output_name, workers, progress,
+                  incremental, checksum, backend, combine, weights, in_memory, memmap, background):
+    '''
+    The stages of make_mosaic(), adding a profile record of each to records
+    '''
+    start = usage(reset=True)
     rtn =  mImgtbl(pre_mosaic_path, 'pre_mosaic.tbl') # create pre-mosaic image list
     print("mImgtbl (pre-mosaic image table):  " + str(rtn), flush=True) # update the process
+    records.append(usage_record('image table', start))
+    start = usage(reset=True)
     mMakeHdr('pre_mosaic.tbl', 'mosaic_template.hdr') # create the header for the mosaic
-    mkdir(proj_path)
-    for each in glob.glob('*.fits'):
-        # reproject all the pre-mosaic fields into the same template header
-        mProjectQL(each, proj_path + each[:-5] + '_proj.fits',pre_mosaic_path + 'mosaic_template.hdr')
+    records.append(usage_record('template header', start))
+    template = pre_mosaic_path + 'mosaic_template.hdr'
+    filenames = glob.glob('*.fits')
+    if weights is not None:
+        weights = [weights[each] for each in filenames]
+    if in_memory:
+        if backend != 'numpy':
+            raise ValueError("in_memory=True needs backend='numpy'")
+        if background:
+            raise ValueError("background matching works on the _proj.fits, not with in_memory=True")
+        start = usage(reset=True)
+        mkdir(final_path)
+        coadd_memory(filenames, [fits.getheader(each) for each in filenames], read_template(template),
+                     final_path + output_name, combine, weights, workers, memmap)
+        print("coadd (%s):  %d fields" % (combine, len(filenames)), flush=True)
+        records.append(usage_record('projection + coadd', start))
+        return
+    start = usage(reset=True)
+    if incremental:
+        os.makedirs(proj_path, exist_ok=True)
+        todo, manifest = changed_tiles(filenames, proj_path, template, checksum)
+        print("%d of %d fields to reproject" % (len(todo), len(filenames)), flush=True)
+    else:
+        mkdir(proj_path)
+        template_hash = file_hash(template)
+        todo = filenames
+        manifest = dict((each, tile_state(each, template_hash, checksum)) for each in filenames)
+    records.append(usage_record('manifest', start))
+    # reproject all the pre-mosaic fields into the same template header
+    start = usage(reset=True)
+    ntile = len(records)
+    rtns = project_tiles(todo, proj_path, template, workers, progress, records)
+    record = usage_record('projection', start)
+    # each field resets the peak of the process it runs in, so take theirs too
+    record['peak_rss'] = max([record['peak_rss']] + [r['peak_rss'] for r in records[ntile:]])
+    records.append(record)
+    for each in todo:
+        if rtns[each]['status'] != '0': # not recorded, so it is tried again next time
+            manifest.pop(each)
+    save_manifest(proj_path, manifest) # for a later incremental run
+    done = [i for i, each in enumerate(filenames) if each in manifest]
+    if background:
+        start = usage(reset=True)
+        header = read_template(template)
+        planes = background_planes([filenames[i] for i in done], proj_path, header, manifest, workers)
+        records.append(usage_record('background', start))
+    start = usage(reset=True)
+    if backend == 'numpy':
+        images = (read_proj(proj_path + filenames[i][:-5] + '_proj.fits') for i in done)
+        if background:
+            images = (subtract_plane(data, hdr, planes[filenames[i]], header)
+                      for i, (data, hdr) in zip(done, images))
+        if weights is not None:
+            weights = [weights[i] for i in done]
+        mkdir(final_path)
+        coadd(images, template, final_path + output_name, combine, weights, memmap)
+        print("coadd (%s):  %d fields" % (combine, len(done)), flush=True)
+        records.append(usage_record('coadd', start))
+        return
+    if background:
+        corr_path = proj_path.rstrip('/') + '_bg/'
+        mkdir(corr_path)
+        for i in done:
+            name = filenames[i][:-5] + '_proj.fits'
+            data, hdr = subtract_plane(*read_proj(proj_path + name), planes[filenames[i]], header)
+            fits.PrimaryHDU(data, header=hdr).writeto(corr_path + name)
+        proj_path = corr_path
+        records.append(usage_record('background correction', start))
+        start = usage(reset=True)
     rtn = mImgtbl(proj_path, 'reprojected.tbl')
     print("mImgtbl (reprojected image table):  " + str(rtn), flush=True) # update the process
+    records.append(usage_record('reprojected table', start))
+    start = usage(reset=True)
     mkdir(final_path)
-    rtn = mAdd('./', 'reprojected.tbl', 'mosaic_template.hdr', final_path+'final_mosaic.fits',debug=1)
+    rtn = mAdd('./', 'reprojected.tbl', 'mosaic_template.hdr', final_path+output_name,debug=1)
     print("mAdd:  " + str(rtn), flush=True)
+    records.append(usage_record('coadd', start))
+
+def build_tile(fields, boxes, header, region, combine='mean', weights=None, output=None):
+    '''
+    Mosaic one region (slice_y, slice_x) of the template grid from the
+    fields overlapping it, with their boxes from cutout_slices(). Each
+    field is reprojected onto its overlap with the region only. Write the
+    piece to output if given and return its name, else return the mosaic
+    and area arrays of the piece
+    '''
+    sy, sx = region
+    sub = region_header(header, region)
+    def images():
+        for each, (by, bx) in zip(fields, boxes):
+            box = (slice(max(by.start, sy.start) - sy.start, min(by.stop, sy.stop) - sy.start),
+                   slice(max(bx.start, sx.start) - sx.start, min(bx.stop, sx.stop) - sx.start))
+            yield project_memory(each, sub, box)
+    mosaic, area = combine_images(images(), sub, combine, weights)
+    if output is None:
+        return mosaic, area
+    fits.PrimaryHDU(mosaic, header=sub).writeto(output, overwrite=True)
+    return output
+
+def make_tiled_mosaic(pre_mosaic_path='./', final_path='./final/', output_name='final_mosaic.fits',
+                      tile_size=4096, workers=1, combine='mean', weights=None, single_file=False):
+    '''
+    Mosaic the fields in pieces of tile_size x tile_size pixels of the
+    template grid, for fields too large for memory. Each piece is built on
+    its own by build_tile() from only the fields overlapping it
+    (tile_index()), `workers` pieces at a time. combine and weights (a dict
+    by field name) are as in coadd().
+    By default each piece is written to final_path as
+    <name>_<row>_<col>.fits, with an index <name>_tiles.json of where they
+    lie on the template grid; pieces without any field are left out. With
+    single_file=True, the pieces are instead streamed in row order into
+    one output_name, holding one row of pieces in memory at most
+    '''
+    rtn =  mImgtbl(pre_mosaic_path, 'pre_mosaic.tbl') # create pre-mosaic image list
+    print("mImgtbl (pre-mosaic image table):  " + str(rtn), flush=True) # update the process
+    mMakeHdr('pre_mosaic.tbl', 'mosaic_template.hdr') # create the header for the mosaic
+    header = read_template(pre_mosaic_path + 'mosaic_template.hdr')
+    filenames = glob.glob('*.fits')
+    boxes = [cutout_slices(fits.getheader(each), header) for each in filenames]
+    index = tile_index(boxes, tile_size)
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    ncol = (shape[1] + tile_size - 1) // tile_size
+    stem = output_name[:-5]
+    mkdir(final_path)
+
+    def job(n, region):
+        found = query_index(index, region)
+        w = None if weights is None else [weights[filenames[i]] for i in found]
+        output = None if single_file else final_path + '%s_%03d_%03d.fits' % (stem, n // ncol, n % ncol)
+        return ([filenames[i] for i in found], [boxes[i] for i in found], header, region, combine, w, output)
+
+    regions = grid_regions(shape, tile_size)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if not single_file:
+            jobs = [job(n, region) for n, region in enumerate(regions)]
+            jobs = [args for args in jobs if args[0]]
+            if pool is None:
+                names = [build_tile(*args) for args in jobs]
+            else:
+                names = list(pool.map(build_tile, *zip(*jobs))) if jobs else []
+            tiles = [{'file': os.path.basename(name), 'y0': args[3][0].start, 'x0': args[3][1].start,
+                      'ny': args[3][0].stop - args[3][0].start, 'nx': args[3][1].stop - args[3][1].start}
+                     for name, args in zip(names, jobs)]
+            with open(final_path + stem + '_tiles.json', 'w') as f:
+                json.dump({'shape': shape, 'tile_size': tile_size, 'tiles': tiles,
+                           'template': header.tostring(sep='\n')}, f, indent=1)
+            print("build_tile:  %d pieces in %s" % (len(tiles), final_path + stem + '_tiles.json'), flush=True)
+            return
+        hdr = new_header(header, shape)
+        with open(final_path + output_name, 'wb') as fobj:
+            fobj.write(hdr.tostring().encode('ascii'))
+            for row in range(0, len(regions), ncol):
+                jobs = [job(n, regions[n]) for n in range(row, row + ncol)]
+                strip = np.full((regions[row][0].stop - regions[row][0].start, shape[1]), np.nan)
+                todo = [args for args in jobs if args[0]]
+                if pool is None:
+                    pieces = [build_tile(*args) for args in todo]
+                else:
+                    pieces = list(pool.map(build_tile, *zip(*todo))) if todo else []
+                for args, (mosaic, area) in zip(todo, pieces):
+                    strip[:, args[3][1]] = mosaic
+                fobj.write(strip.astype('>f8').tobytes())
+                print("build_tile:  row %d of %d" % (row // ncol + 1, len(regions) // ncol), flush=True)
+            nbytes = shape[0] * shape[1] * 8
+            fobj.write(b'\0' * ((nbytes + 2879) // 2880 * 2880 - nbytes)) # FITS data is padded to 2880-byte blocks
+    finally:
+        if pool is not None:
+            pool.shutdown()
@@ -0,0 +1,171 @@
+# include packages
+# pip install MontagePy==1.2.3 reproject
+# Mosaic data cubes on the template header from make_header(), a block of
+# channels at a time, so that dozens of large cubes fit in memory. All
+# cubes must share the same spectral axis (regrid them first otherwise).
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from astropy.io import fits
+from astropy import wcs
+from reproject import reproject_interp
+from mosaic2D import mkdir, read_template, image_table, make_header, new_header, cutout_slices, tile_index, query_index, grid_regions, COMBINES
+
+SPECTRAL_KEYS = ('CTYPE3', 'CUNIT3', 'SPECSYS', 'RESTFRQ', 'RESTFREQ', 'BUNIT') # the 2-D template leaves them out
+
+def new_fits(filename, header, shape, bitpix=-64):
+    '''
+    Create a FITS file of the given shape (numpy order) on disk without
+    holding its data in memory. The data part is left blank (zeros).
+    '''
+    hdr = new_header(header, shape, bitpix)
+    hdr.tofile(filename, overwrite=True)
+    nbytes = int(np.prod(shape)) * abs(bitpix) // 8
+    nbytes = (nbytes + 2879) // 2880 * 2880 # FITS data is padded to 2880-byte blocks
+    with open(filename, 'rb+') as fobj:
+        fobj.seek(len(hdr.tostring()) + nbytes - 1)
+        fobj.write(b'\0')
+
+def check_spectral_axes(headers, template_header=None):
+    '''
+    Raise a ValueError unless all cubes have the same channels, and,
+    given the template header (cube_template()), unless its spectral axis
+    gives the channels of the cubes
+    '''
+    first = wcs.WCS(headers[0]).spectral
+    nv = headers[0]['NAXIS3']
+    v = first.pixel_to_world_values(np.arange(nv))
+    for hdr in headers[1:]:
+        if hdr['NAXIS3'] != nv or not np.allclose(wcs.WCS(hdr).spectral.pixel_to_world_values(np.arange(nv)), v,
+                                                  rtol=1e-9, atol=0):
+            raise ValueError("the cubes do not share the same spectral axis, regrid them first")
+    if template_header is not None:
+        w = wcs.WCS(template_header).spectral
+        if not np.allclose(w.pixel_to_world_values(np.arange(nv)), v, rtol=1e-9, atol=0):
+            raise ValueError("the spectral axis of the template header does not match the cubes")
+
+def cube_template(template, first_header):
+    '''
+    The celestial template header of the cubes (a file written by mMakeHdr
+    or a Header from make_header()), completed with
+    the spectral keywords and unit of the first cube. The spectral axis is
+    rebuilt from the WCS of the first cube, so that a channel width kept
+    in PC3_3 or CD3_3 (as in JCMT/Starlink cubes) ends up in CDELT3
+    '''
+    header = read_template(template)
+    for key in ('NAXIS3',) + SPECTRAL_KEYS:
+        if key in first_header:
+            header[key] = first_header[key]
+    spectral = wcs.WCS(first_header).spectral
+    header['NAXIS'] = 3
+    header['CTYPE3'] = spectral.wcs.ctype[0]
+    header['CUNIT3'] = spectral.wcs.cunit[0].to_string('fits')
+    header['CRVAL3'] = spectral.wcs.crval[0]
+    header['CRPIX3'] = spectral.wcs.crpix[0]
+    header['CDELT3'] = spectral.pixel_scale_matrix[0, 0] # CDELT3 * PC3_3
+    for key in ('PC3_3', 'CD3_3'):
+        header.remove(key, ignore_missing=True)
+    return header
+
+def read_channels(filename, v0, v1):
+    '''
+    Channels v0:v1 of a cube (a degenerate Stokes axis is dropped) and its
+    celestial WCS, reading only those channels from disk
+    '''
+    with fits.open(filename, memmap=True) as hdul:
+        data = hdul[0].data
+        data = data.reshape(data.shape[-3:])
+        return np.array(data[v0:v1], dtype=np.float64), wcs.WCS(hdul[0].header).celestial
+
+def mosaic_block(filenames, cutouts, template_header, output_name, v0, v1, combine='mean', weights=None,
+                 bucket=128):
+    '''
+    Reproject channels v0:v1 of the cubes onto their cutouts of the
+    template grid and co-add them (combine is one of COMBINES, as in
+    mosaic2D.coadd) into the same channels of an existing output FITS file.
+    The median is taken on bucket x bucket regions, from only the cubes
+    overlapping each (tile_index())
+    '''
+    shape = (v1 - v0, template_header['NAXIS2'], template_header['NAXIS1'])
+    w_template = wcs.WCS(template_header).celestial
+    total, area, cut_data = np.zeros(shape), np.zeros(shape), {}
+    for i, (each, cut) in enumerate(zip(filenames, cutouts)):
+        if cut is None:
+            continue
+        sy, sx = cut
+        data, w_in = read_channels(each, v0, v1)
+        data, _fp = reproject_interp((data, w_in), w_template.slice((sy, sx)),
+                                     shape_out=(v1 - v0, sy.stop - sy.start, sx.stop - sx.start))
+        good = np.isfinite(data)
+        if combine == 'median':
+            cut_data[i] = data
+            continue
+        w = 1. if combine == 'mean' else float(weights[i])
+        total[:, sy, sx] += np.where(good, data, 0.) * w
+        area[:, sy, sx] += good * w
+    if combine == 'median':
+        block = np.full(shape, np.nan)
+        index = tile_index([cut if i in cut_data else None for i, cut in enumerate(cutouts)], bucket)
+        for ry, rx in grid_regions(shape[1:], bucket):
+            found = query_index(index, (ry, rx))
+            if not found:
+                continue
+            stack = np.full((len(found), shape[0], ry.stop - ry.start, rx.stop - rx.start), np.nan)
+            for k, i in enumerate(found):
+                sy, sx = cutouts[i]
+                y0, y1 = max(sy.start, ry.start), min(sy.stop, ry.stop)
+                x0, x1 = max(sx.start, rx.start), min(sx.stop, rx.stop)
+                stack[k, :, y0 - ry.start:y1 - ry.start, x0 - rx.start:x1 - rx.start] = \
+                    cut_data[i][:, y0 - sy.start:y1 - sy.start, x0 - sx.start:x1 - sx.start]
+            covered = np.isfinite(stack).any(0)
+            sub = block[:, ry, rx]
+            sub[covered] = np.nanmedian(stack[:, covered], axis=0)
+    else:
+        block = np.full(shape, np.nan)
+        np.divide(total, area, out=block, where=area > 0)
+    with fits.open(output_name, mode='update', memmap=True) as hdul:
+        hdul[0].data[v0:v1] = block
+    return v0, v1
+
+def make_cube_mosaic(pre_mosaic_path='./', final_path='./final/', output_name='final_cube_mosaic.fits',
+                     chunk=64, workers=1, combine='mean', weights=None):
+    '''
+    Mosaic the cubes in pre_mosaic_path: make the template header with
+    make_header() (mMakeHdr misreads cubes whose pixel scale is in PC1_1
+    and PC1_2, as JCMT cubes), then reproject and co-add them `chunk` channels at a time
+    straight into the output FITS file on disk. Memory is set by chunk,
+    not by the number or size of the cubes (for combine='median', every
+    cube overlapping is held for one block). With workers > 1 the channel
+    blocks are shared out to that many processes. combine and weights (a
+    dict by cube name) are as in mosaic2D.coadd
+    '''
+    if combine not in COMBINES:
+        raise ValueError("combine must be one of %s, not %r" % (', '.join(COMBINES), combine))
+    if combine == 'weighted' and weights is None:
+        raise ValueError("combine='weighted' needs the weights")
+    table, rtn = image_table(sorted(glob.glob(pre_mosaic_path + '*.fits'))) # create pre-mosaic cube list
+    print("image_table (pre-mosaic cube table):  " + str(rtn), flush=True) # update the process
+    filenames = [row['fname'] for row in table]
+    headers = [row['header'] for row in table]
+    header = cube_template(make_header(table), headers[0]) # create the header for the mosaic
+    check_spectral_axes(headers, header)
+    cutouts = [cutout_slices(hdr, header) for hdr in headers]
+    if weights is not None:
+        weights = [weights[os.path.basename(each)] for each in filenames]
+    nv = header['NAXIS3']
+    shape = (nv, header['NAXIS2'], header['NAXIS1'])
+    mkdir(final_path)
+    new_fits(final_path + output_name, header, shape)
+    blocks = [(v0, min(v0 + chunk, nv)) for v0 in range(0, nv, chunk)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(mosaic_block, filenames, cutouts, header, final_path + output_name,
+                                v0, v1, combine, weights) for v0, v1 in blocks]
+            for job in as_completed(jobs):
+                v0, v1 = job.result()
+                print("Mosaicked channels %d-%d of %d" % (v0, v1 - 1, nv), flush=True)
+    else:
+        for v0, v1 in blocks:
+            mosaic_block(filenames, cutouts, header, final_path + output_name, v0, v1, combine, weights)
+            print("Mosaicked channels %d-%d of %d" % (v0, v1 - 1, nv), flush=True)
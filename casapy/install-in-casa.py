@@ -45,9 +45,88 @@
 ##--------------------------------------------------------------------------------------------------------------------------------------------------------
 import os                                                                                   ## import os package
 import sys                                                                                  ## import sys package
+import time                                                                                 ## import time package
+import hashlib                                                                              ## import hashlib package
+import json                                                                                 ## import json package
+import shutil                                                                               ## import shutil package
+import subprocess                                                                           ## import subprocess package
+import multiprocessing                                                                      ## import multiprocessing package
 ##--------------------------------------------------------------------------------------------------------------------------------------------------------
 
 
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## get name of the xml tag, which opens the (stripped) line striplines, or an empty string for comments and other lines
+##
+def GetLineTag(striplines):
+    """
+
+input parameters:
+-----------------
+
+    - striplines:           line of the xml file without leading and trailing blanks
+
+
+output parameters:
+------------------
+
+    - tagName:              name of the tag, e.g. "PathStartScript" for the line "<PathStartScript>...</PathStartScript>"
+
+    """
+    tagName = ""
+
+
+    ## analyze line
+    if (striplines.startswith("<") and not striplines.startswith("<!--")):                 ## ignore comments
+        i = striplines.find(">")
+        if (i > 1 and striplines[1:i].find("<") == (-1) and striplines[1:i].find(" ") == (-1)):
+            tagName = striplines[1:i]
+
+
+    ## define return value
+    return tagName
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## read all xml tags in xml file xmlFileName in a single pass and return their contents in the dictionary TagIndex
+##
+def GetXMLtagIndex(xmlFileName):
+    """
+
+input parameters:
+-----------------
+
+    - xmlFileName:          path and name of the xml-file
+
+
+output parameters:
+------------------
+
+    - TagIndex:             dictionary including the contents of each tag, which is opened and closed on the same line, i.e.
+                            TagIndex[tagName] is a list including an entry for each occurance
+
+    """
+    TagIndex = {}
+
+
+    ## analyze contents of xml file line by line
+    xmlFile = open(xmlFileName)
+    for line in xmlFile:                                                                    ## loop over all lines in the xml file
+        striplines = line.strip()
+        tagName = GetLineTag(striplines)
+        if (tagName != ""):
+            i = striplines.find(">")
+            j = striplines.rfind("<")
+            if (i < j):
+                TagIndex.setdefault(tagName, []).append(striplines[i + 1:j])                ## save contents in list
+    xmlFile.close()
+
+
+    ## define return value
+    return TagIndex
+
+
 ##--------------------------------------------------------------------------------------------------------------------------------------------------------
 ##
 ## read xml tags with name tagName in xml file GetXMLtag and return contents in ContentsTag
@@ -69,30 +148,103 @@ output parameters:
     - ContentsTag:          the contents of the selected tag, always a list, including an entry for each occurance
 
     """
-    ContentsTag = []
 
 
-    ## read in whole xml-file
-    xmlFile = open(xmlFileName)
-    ContentsXMLFile = xmlFile.readlines()
-    xmlFile.close()
+    ## define return value
+    return GetXMLtagIndex(xmlFileName).get(tagName, [])
 
 
-    ## analyze contents of xml file
-    for line in ContentsXMLFile:                                                            ## loop over all lines in the xml file
-        striplines = line.strip()
-        if (not striplines.startswith("<!--")):
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## modify file FileName line by line in a single pass, the modified file replaces the old one only when it is complete
+##
+def EditFileLines(FileName, EditLine):
+    """
+
+input parameters:
+-----------------
+
+    - FileName:             path and name of the file
+
+    - EditLine:             function, which returns the new contents of a line for the old one (including the line break)
+
+
+output parameters:
+------------------
+
+    - ChangedFlag:          True, if the contents of the file was modified
+
+    """
+    ChangedFlag = False
+
+
+    ## write modified lines to a temporary file in the same directory
+    TempFileName = FileName + ".tmp"
+    OldFile = open(FileName)
+    NewFile = open(TempFileName, 'w')
+    for line in OldFile:                                                                    ## loop over all lines in the file
+        newline = EditLine(line)
+        if (newline != line):
+            ChangedFlag = True
+        NewFile.write(newline)
+    OldFile.close()
+    NewFile.close()
+
+
+    ## replace old file by the temporary file, an unchanged file is not touched at all
+    if (ChangedFlag):
+        shutil.copymode(FileName, TempFileName)
+        os.rename(TempFileName, FileName)
+    else:
+        os.remove(TempFileName)
+
+
+    ## define return value
+    return ChangedFlag
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## write the contents of several tags to xml file xmlFileName in a single pass
+##
+def WriteXMLtags(xmlFileName, DictOfTags):
+    """
+
+input parameters:
+-----------------
+
+    - xmlFileName:          path and name of the xml-file
+
+    - DictOfTags:           dictionary including the new contents of each tag, which has to be modified, i.e. DictOfTags[tagName] is
+                            a list including a content for each occurance of the tag (further occurances are not modified)
+
+
+output parameters:
+------------------
+
+    - ChangedFlag:          True, if the contents of the xml file was modified
+
+    """
+    counter = {}                                                                            ## counter of the occurances of each tag
+
 
+    ## replace the contents of each tag in DictOfTags, keep indentation and line break of the old line
+    def EditLine(line):
+        tagName = GetLineTag(line.strip())
+        if (not tagName in DictOfTags):
+            return line
+        counter[tagName] = counter.get(tagName, (-1)) + 1
+        if (counter[tagName] >= len(DictOfTags[tagName])):
+            return line
+        space = line[:line.find("<")]
+        linebreak = line[len(line.rstrip("\r\n")):]
+        if (linebreak == ""):
+            linebreak = "\n"
+        return space + "<" + tagName + ">" + DictOfTags[tagName][counter[tagName]] + "</" + tagName + ">" + linebreak
 
-            ## get name(s) of exp data file(s)
-            if (striplines.find("<" + tagName + ">") > (-1)):                               ## get name of experimental data file
-                i = striplines.find(">")
-                j = striplines.rfind("<")
-                if (i < j):
-                    ContentsTag.append(striplines[i + 1:j])                                 ## save name(s) in list
 
     ## define return value
-    return ContentsTag
+    return EditFileLines(xmlFileName, EditLine)
 
 
 ##--------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -121,35 +273,354 @@ output parameters:
     """
 
 
-    ## read in whole xml-file
-    xmlFile = open(xmlFileName)
-    ContentsXMLFile = xmlFile.readlines()
-    xmlFile.close()
+    ## write tag
+    WriteXMLtags(xmlFileName, {tagName: ContentsTag})
 
 
-    ## analyze contents of xml file
-    NXF = open(xmlFileName, 'w')                                                            ## open xml file
-    counter = (-1)                                                                          ## reset counter
-    for line in ContentsXMLFile:                                                            ## loop over all lines in the xml file
-        striplines = line.strip()                                                           ## remove leading and trailing blanks
-        if (not striplines.startswith("<!--")):                                             ## ignore comments
-            if (striplines.find("<" + tagName + ">") > (-1)):                               ## get name of experimental data file
-                counter += 1
-                i = line.find("<")
-                if (i > (-1)):
-                    space = line[:i]
-                else:
-                    space = ""
-                NXF.write(space + "<" + tagName + ">" + ContentsTag[counter] + "</" + tagName + ">\n")
-            else:
-                NXF.write(line)
-        else:
-            NXF.write(line)
-    NXF.close()
+    ## define return value
+    return
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## execute a shell command and return its screen output (stdout and stderr) as list of lines
+##
+def GetCommandOutput(cmdString):
+    """
+
+input parameters:
+-----------------
+
+    - cmdString:            shell command
+
+
+output parameters:
+------------------
+
+    - CommandOutput:        the screen output of the command, a list including an entry for each line
+
+    """
+
+
+    ## execute command and catch screen output
+    Process = subprocess.Popen(cmdString, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    ScreenOutput = Process.communicate()[0]
+    CommandOutput = ScreenOutput.decode("utf-8", "replace").splitlines(True)
+
+
+    ## define return value
+    return CommandOutput
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## compute a hash of the source files (Fortran, C, include files, makefiles and shell scripts) below directory SourceDir
+##
+def GetSourceTreeHash(SourceDir, ListOfExcludedDirs = []):
+    """
+
+input parameters:
+-----------------
+
+    - SourceDir:            path of the source directory
+
+    - ListOfExcludedDirs:   list of sub-directories of SourceDir (relative to SourceDir), which are not included
+
+
+output parameters:
+------------------
+
+    - SourceTreeHash:       hash (hex digits) of the relative paths and the contents of all source files
+
+    """
+    SourceExtensions = (".f", ".f90", ".f95", ".for", ".inc", ".c", ".cc", ".cpp", ".h", ".sh", ".mk")
+    SourceTreeHash = hashlib.sha1()
+
+
+    ## walk through the source directory in a fixed order, the relative paths are used, so that the hash does not change when the
+    ## XCLASS directory is moved
+    for LocalDir, ListOfSubDirs, ListOfFiles in os.walk(SourceDir):
+        RelativeDir = os.path.relpath(LocalDir, SourceDir)
+        ListOfSubDirs[:] = sorted([d for d in ListOfSubDirs if (os.path.normpath(os.path.join(RelativeDir, d)) not in ListOfExcludedDirs)])
+        for LocalFile in sorted(ListOfFiles):
+            if (LocalFile.lower().endswith(SourceExtensions) or LocalFile.lower().startswith("makefile")):
+                SourceTreeHash.update(os.path.join(RelativeDir, LocalFile).encode("utf-8") + b"\0")
+                SourceFile = open(os.path.join(LocalDir, LocalFile), 'rb')
+                SourceTreeHash.update(SourceFile.read())
+                SourceFile.close()
+
+
+    ## define return value
+    return SourceTreeHash.hexdigest()
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## compute a hash of the contents of file FileName
+##
+def GetFileHash(FileName):
+    """
+
+input parameters:
+-----------------
+
+    - FileName:             path and name of the file
+
+
+output parameters:
+------------------
+
+    - FileHash:             hash (hex digits) of the contents of the file, an empty string if the file does not exist
+
+    """
+    FileHash = ""
+
+
+    ## read in file
+    if (os.path.isfile(FileName)):
+        LocalFile = open(FileName, 'rb')
+        FileHash = hashlib.sha1(LocalFile.read()).hexdigest()
+        LocalFile.close()
+
+
+    ## define return value
+    return FileHash
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## read the build cache, i.e. the source tree hash, the compiler versions and the compile flag of each successfully compiled component
+##
+def ReadBuildCache(CacheFileName):
+    """
+
+input parameters:
+-----------------
+
+    - CacheFileName:        path and name of the cache file
+
+
+output parameters:
+------------------
+
+    - BuildCache:           dictionary including an entry for each component, an empty dictionary if there is no (readable) cache file
+
+    """
+    BuildCache = {}
+
+
+    ## read in cache file
+    if (os.path.isfile(CacheFileName)):
+        try:
+            CacheFile = open(CacheFileName)
+            BuildCache = json.load(CacheFile)
+            CacheFile.close()
+        except ValueError:
+            BuildCache = {}
+
+
+    ## define return value
+    return BuildCache
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## write the build cache
+##
+def WriteBuildCache(CacheFileName, BuildCache):
+    """
+
+input parameters:
+-----------------
+
+    - CacheFileName:        path and name of the cache file
+
+    - BuildCache:           dictionary including an entry for each component
+
+
+output parameters:
+------------------
+
+    - None
+
+    """
+
+
+    ## write to a temporary file first and rename it, so that an interrupted run never leaves a broken cache file
+    CacheFile = open(CacheFileName + ".tmp", 'w')
+    json.dump(BuildCache, CacheFile, indent=4, sort_keys=True)
+    CacheFile.close()
+    os.rename(CacheFileName + ".tmp", CacheFileName)
 
 
     ## define return value
     return
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## count the executables in directory TestDIR
+##
+def CountEXEFiles(TestDIR):
+    """
+
+input parameters:
+-----------------
+
+    - TestDIR:              path of the directory
+
+
+output parameters:
+------------------
+
+    - CounterEXEFiles:      number of files ending with ".exe"
+
+    """
+    CounterEXEFiles = 0
+
+
+    ## count files
+    if (os.path.isdir(TestDIR)):
+        for LocalFile in os.listdir(TestDIR):
+            if (LocalFile.endswith(".exe")):
+                CounterEXEFiles += 1
+
+
+    ## define return value
+    return CounterEXEFiles
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## run the shell commands in ListOfJobs, NumberOfJobs at a time, and write the screen output of each job into its own log file
+##
+def RunJobs(ListOfJobs, NumberOfJobs, LogDir):
+    """
+
+input parameters:
+-----------------
+
+    - ListOfJobs:           list of jobs, each job is a list [name, shell command, working directory]
+
+    - NumberOfJobs:         maximal number of jobs running at the same time
+
+    - LogDir:               path of the directory, where the screen output of each job is written to the file <name>.log
+
+
+output parameters:
+------------------
+
+    - JobResults:           dictionary including the return code and the run time (in seconds) of each job, i.e. JobResults[name] = [rtn, time]
+
+    """
+    JobResults = {}
+
+
+    ## create log directory
+    if (not os.path.isdir(LogDir)):
+        os.makedirs(LogDir)
+
+
+    ## start jobs until NumberOfJobs jobs are running and wait for running jobs to finish
+    WaitingJobs = list(ListOfJobs)
+    RunningJobs = []
+    while (WaitingJobs != [] or RunningJobs != []):
+
+
+        ## start new jobs
+        while (WaitingJobs != [] and len(RunningJobs) < max(1, NumberOfJobs)):
+            JobName, JobCommand, JobDir = WaitingJobs.pop(0)
+            LogFile = open(LogDir + JobName + ".log", 'w')
+            Process = subprocess.Popen(JobCommand, shell=True, cwd=JobDir, stdout=LogFile, stderr=subprocess.STDOUT)
+            RunningJobs.append([JobName, Process, LogFile, time.time()])
+
+
+        ## check for finished jobs
+        StillRunningJobs = []
+        for LocalJob in RunningJobs:
+            JobName, Process, LogFile, StartTime = LocalJob
+            rtn = Process.poll()
+            if (rtn is None):
+                StillRunningJobs.append(LocalJob)
+            else:
+                LogFile.close()
+                JobResults[JobName] = [rtn, time.time() - StartTime]
+                print("\tFinished " + JobName + " (return code " + str(rtn) + ", %.1f s)" % JobResults[JobName][1])
+        RunningJobs = StillRunningJobs
+        if (RunningJobs != []):
+            time.sleep(0.1)
+
+
+    ## define return value
+    return JobResults
+
+
+##--------------------------------------------------------------------------------------------------------------------------------------------------------
+##
+## define the lines of the init.py file, which register the XCLASS tasks in CASA
+##
+def GetInitLines(ListOfFunctionNames, myXCLASSDir, LazyFlag):
+    """
+
+input parameters:
+-----------------
+
+    - ListOfFunctionNames:  list of the names of the tasks
+
+    - myXCLASSDir:          path of the XCLASS directory
+
+    - LazyFlag:             if True, each task is registered as a small stub, which executes the file <func>_Func.py on the first call
+                            of the task, otherwise all <func>_Func.py files are executed, when CASA starts
+
+
+output parameters:
+------------------
+
+    - InitLines:            list of lines (including line breaks), the first and the last line mark the XCLASS block in the init.py file
+
+    """
+
+
+    ## start block and measure the time used to register the tasks (printed, if the environment variable XCLASS_STARTUP_TIME is set)
+    InitLines = ["## XCLASS tasks (begin)\n", \
+                 "import time as __XCLASSTime\n", \
+                 "__XCLASSStartTime = __XCLASSTime.time()\n"]
+
+
+    ## define the stubs, which replace themselves by the task, when they are called for the first time
+    if (LazyFlag):
+        InitLines += ["def __XCLASSLazyTask(TaskName, TaskFileName):\n", \
+                      "    def LazyTask(*args, **kwargs):\n", \
+                      "        TaskNamespace = globals()\n", \
+                      "        execfile(TaskFileName, TaskNamespace)\n", \
+                      "        if (TaskNamespace.get(TaskName) is LazyTask):\n", \
+                      "            raise NameError(TaskFileName + " + chr(34) + " does not define task " + chr(34) + " + TaskName)\n", \
+                      "        return TaskNamespace[TaskName](*args, **kwargs)\n", \
+                      "    LazyTask.__name__ = TaskName\n", \
+                      "    LazyTask.__doc__ = " + chr(34) + "XCLASS task " + chr(34) + " + TaskName + " + chr(34) \
+                      + ", which is loaded from " + chr(34) + " + TaskFileName + " + chr(34) + " when it is called for the first time." \
+                      + chr(34) + "\n", \
+                      "    return LazyTask\n"]
+        for func in ListOfFunctionNames:
+            InitLines.append(func + " = __XCLASSLazyTask(" + chr(34) + func + chr(34) + ", " + chr(34) + myXCLASSDir + "build_tasks/" + func \
+                             + "_Func.py" + chr(34) + ")\n")
+
+
+    ## execute all task files
+    else:
+        for func in ListOfFunctionNames:
+            InitLines.append("execfile(" + chr(34) + myXCLASSDir + "build_tasks/" + func + "_Func.py" + chr(34) + ")\n")
+
+
+    ## end block
+    InitLines += ["XCLASSStartupTime = __XCLASSTime.time() - __XCLASSStartTime\n", \
+                  "if (" + chr(34) + "XCLASS_STARTUP_TIME" + chr(34) + " in __import__(" + chr(34) + "os" + chr(34) + ").environ):\n", \
+                  "    print(" + chr(34) + "XCLASS tasks registered in %.3f s" + chr(34) + " % XCLASSStartupTime)\n", \
+                  "## XCLASS tasks (end)\n"]
+
+
+    ## define return value
+    return InitLines
 ##--------------------------------------------------------------------------------------------------------------------------------------------------------
 
 
@@ -186,6 +657,22 @@ if (__name__ == '__main__'):
 
         "--nocasa":         Do not execute the CASA installation scripts and compile only.
 
+        "--lazy":           Register small stubs for the XCLASS tasks in the init.py file of CASA
+                            instead of executing all task files, whenever CASA starts. A task
+                            (and the python packages it needs) is loaded, when it is called for
+                            the first time, so that CASA starts faster. (Note, inp and go can be
+                            used for a task only after its first call.)
+
+        "--rebuild":        Compile MAGIX and myXCLASS and execute the buildmytasks script for all
+                            tasks, even if the build cache (build_cache.json) says, that their
+                            inputs have not changed since the last run.
+
+        "-j N", "--jobs=N": Number of jobs running at the same time: MAGIX, the MAGIX demo model
+                            programs and myXCLASS are compiled side by side (each make with N
+                            jobs) and the buildmytasks script is executed for N tasks at a
+                            time. (Default: number of CPUs, "-j 1" runs everything one by one.)
+                            The screen output of each job is written to build_logs/<job>.log.
+
         "--help":           Print this information to screen
 
 
@@ -232,10 +719,9 @@ if (__name__ == '__main__'):
 
 
     ##====================================================================================================================================================
-    ## determine compile_flag
+    ## determine compile_flag, the build cache decides, which components have to be compiled once again
     compile_flag = True
-    if (os.path.isfile("programs/myXCLASS/src/myNewXCLASS.exe")):
-        compile_flag = False
+    RebuildFlag = False
 
     # Debug:
     # print "compile_flag = ", compile_flag
@@ -245,13 +731,31 @@ if (__name__ == '__main__'):
     ## analyze command line arguments
     MAGIXCompilationFlag = "smp"
     NoCASAFlag = False
+    LazyFlag = False
+    NumberOfJobs = multiprocessing.cpu_count()                                              ## by default, run one job per CPU
     if (len(sys.argv) > 1):                                                                 ## check, if command line arguments are defined
-        for argument in sys.argv[1:]:                                                       ## loop over all command line arguments
+        for ArgumentID, argument in enumerate(sys.argv[1:]):                                ## loop over all command line arguments
+
+
+            ##--------------------------------------------------------------------------------------------------------------------------------------------
+            ## get number of jobs, given as "-jN" or "-j N"
+            if (argument.startswith('-j')):
+                JobsString = argument[2:].strip()
+                if (JobsString == "" and ArgumentID + 2 < len(sys.argv)):
+                    JobsString = sys.argv[ArgumentID + 2].strip()
+                try:
+                    NumberOfJobs = int(JobsString)
+                except ValueError:
+                    NumberOfJobs = 0
+                if (NumberOfJobs < 1):
+                    print("\n\nError in the installation script for XCLASS package!")
+                    print("\n\tThe number of jobs has to be a positive integer, not " + chr(34) + JobsString + chr(34) + "!\n\n")
+                    sys.exit(0)
 
 
             ##--------------------------------------------------------------------------------------------------------------------------------------------
             ## get run flags
-            if (argument.startswith('--')):                                                 ## run flags are marked with "--" characters
+            elif (argument.startswith('--')):                                               ## run flags are marked with "--" characters
                 option = argument[2:].strip()                                               ## remove "--" characters and leading and tailing blanks
                 option = option.lower()                                                     ## all small letters
 
@@ -272,6 +776,30 @@ if (__name__ == '__main__'):
                     NoCASAFlag = True
 
 
+                ## register the tasks in CASA as stubs, which load the tasks on their first call
+                elif (option == "lazy"):
+                    LazyFlag = True
+
+
+                ## compile all components, even if they are up to date
+                elif (option == "rebuild"):
+                    compile_flag = True
+                    RebuildFlag = True
+
+
+                ## get number of jobs
+                elif (option.startswith("jobs=")):
+                    JobsString = option[5:].strip()
+                    try:
+                        NumberOfJobs = int(JobsString)
+                    except ValueError:
+                        NumberOfJobs = 0
+                    if (NumberOfJobs < 1):
+                        print("\n\nError in the installation script for XCLASS package!")
+                        print("\n\tThe number of jobs has to be a positive integer, not " + chr(34) + JobsString + chr(34) + "!\n\n")
+                        sys.exit(0)
+
+
                 ## do not compile interface
                 elif (option == "help"):
                     print(helpInformation)
@@ -284,12 +812,7 @@ if (__name__ == '__main__'):
         CASACall = ["which casa", "which casapy"]
         FoundCASAFlag = False
         for LocalCommand in CASACall:
-            cmdString = LocalCommand + " > tmp.out 2>&1"
-            os.system(cmdString)
-            tmpFile = open("tmp.out")
-            CompilerInfo = tmpFile.readlines()
-            tmpFile.close()
-            os.remove("tmp.out")
+            CompilerInfo = GetCommandOutput(LocalCommand)
             if (CompilerInfo != []):
                 FoundCASAFlag = True
                 break
@@ -334,103 +857,121 @@ if (__name__ == '__main__'):
     if (compile_flag):
 
 
-        ## check, if gcc and gfortran compilers are available
+        ## define the independent builds of MAGIX, the MAGIX demo model programs and myXCLASS, i.e. for each build: name of the job,
+        ## directory and number of the executables, build command (%d is replaced by the number of make jobs), working directory,
+        ## description used in the error message, source directory and its sub-directories, which are not part of the build
+        ListOfBuilds = [["MAGIX", myXCLASSDir + "programs/MAGIX/Modules/Levenberg-Marquardt/bin/", 2, \
+                         "MAKEFLAGS=-j%d sh install.sh " + MAGIXCompilationFlag, myXCLASSDir + "programs/MAGIX/", "MAGIX", \
+                         myXCLASSDir + "programs/MAGIX/", ["Fit-Functions"]], \
+                        ["Drude-Lorentz", myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_general/bin/", 19, \
+                         "make -j%d all", myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_general/", "the MAGIX demo model program", \
+                         myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_general/", []], \
+                        ["myXCLASS", myXCLASSDir + "programs/myXCLASS/src/", 1, \
+                         "make -j%d all", myXCLASSDir + "programs/myXCLASS/src/", "the myXCLASS program", \
+                         myXCLASSDir + "programs/myXCLASS/src/", []]]
+        BuildLogDir = myXCLASSDir + "build_logs/"
+
+
+        ## a component is up to date, if its executables exist and the hash of its sources, the compiler versions and the compile flag
+        ## are the same as for the last successful compilation, which are stored in the build cache; check the executables, the sources
+        ## and the compile flag first, so that the compilers are needed only, if something has to be compiled
+        BuildCacheFileName = myXCLASSDir + "build_cache.json"
+        BuildCache = ReadBuildCache(BuildCacheFileName)
+        BuildKeys = {}
+        ListOfOutdatedBuilds = []
+        for LocalBuild in ListOfBuilds:
+            BuildKeys[LocalBuild[0]] = {"SourceHash": GetSourceTreeHash(LocalBuild[6], LocalBuild[7]), \
+                                        "CompilerVersions": [], \
+                                        "CompilationFlag": MAGIXCompilationFlag}
+            CachedKey = BuildCache.get(LocalBuild[0], {})
+            if (RebuildFlag or CachedKey.get("SourceHash") != BuildKeys[LocalBuild[0]]["SourceHash"] \
+                or CachedKey.get("CompilationFlag") != MAGIXCompilationFlag or CountEXEFiles(LocalBuild[1]) != LocalBuild[2]):
+                ListOfOutdatedBuilds.append(LocalBuild)
+
+
+        ## check, if gcc and gfortran compilers (and OpenMPI, if --mpi is selected) are available
         ListOfWarnings = []
-        ListOfCommands = ["gcc -v", "gfortran -v"]
-        for CompilerID, LocalCommand in enumerate(ListOfCommands):
-            cmdString = LocalCommand + " > tmp.out 2>&1"
-            os.system(cmdString)
-            tmpFile = open("tmp.out")
-            CompilerInfo = tmpFile.readlines()
-            tmpFile.close()
-            os.remove("tmp.out")
-            for line in CompilerInfo:
-                if (line.find("not found") > (-1)):
-                    if (CompilerID == 0):
-                        ListOfWarnings.append("gcc")
-                    else:
-                        ListOfWarnings.append("gfortran")
-        if (ListOfWarnings != []):
-            print("\n\nError in the installation script for XCLASS package!")
-            print("\n\tCan not find " + ListOfWarnings[0] + "",)
-            if (len(ListOfWarnings) == 2):
-                print("and " + ListOfWarnings[1] + " ",)
-            print("compiler!")
-            print("\n\tPlease install compiler and re-execute XCLASS installation script!\n\n")
-            sys.exit(0)
-
-
-        ## check, if OpenMPI is available if --mpi is selected
+        CompilerVersions = []                                                               ## version lines of the compilers for the build cache
+        ListOfCommands = [["gcc -v", "gcc"], ["gfortran -v", "gfortran"]]
         if (MAGIXCompilationFlag == "mpi"):
-            cmdString = "mpif90 -v > tmp.out 2>&1"
-            os.system(cmdString)
-            tmpFile = open("tmp.out")
-            CompilerInfo = tmpFile.readlines()
-            tmpFile.close()
-            os.remove("tmp.out")
+            ListOfCommands.append(["mpif90 -v", "OpenMPI"])
+        for LocalCommand, CompilerName in ListOfCommands:
+            CompilerInfo = GetCommandOutput(LocalCommand)
             for line in CompilerInfo:
+                if (line.find(" version ") > (-1)):
+                    CompilerVersions.append(line.strip())
                 if (line.find("not found") > (-1)):
-                    print("\n\nError in the installation script for XCLASS package!")
-                    print("\n\tCan not find OpenMPI compiler!")
-                    print("\n\tPlease install compiler and re-execute XCLASS installation script!\n\n")
-                    sys.exit(0)
+                    ListOfWarnings.append(CompilerName)
 
 
-        ## compile MAGIX and check, if compilation was successfully
-        print("\n\n\nCompile MAGIX ..\n\n")
-        MAGIXTestDIR = myXCLASSDir + "programs/MAGIX/Modules/Levenberg-Marquardt/bin/"
-        cmd_string = "rm -rf " + MAGIXTestDIR + "*.exe"
-        os.system(cmd_string)
-        cmd_string = "cd " + myXCLASSDir + "programs/MAGIX/; sh install.sh " + MAGIXCompilationFlag + "; cd ../.."
-        os.system(cmd_string)
-        ListOfFiles = os.listdir(MAGIXTestDIR)
-        CounterEXEFiles = 0
-        for LocalFile in ListOfFiles:
-            if (LocalFile.endswith(".exe")):
-                CounterEXEFiles += 1
-        if (CounterEXEFiles != 2):
-            print("\n\nError in the installation script for XCLASS package!")
-            print("\n\tThe compilation of MAGIX failed!")
-            print("\n\tPlease take a look at the compiler messages!\n\n")
-            sys.exit(0)
+        ## without compilers, nothing can be compiled: stop, if a component is out of date, otherwise keep the compiled executables
+        if (ListOfWarnings != []):
+            if (ListOfOutdatedBuilds != []):
+                print("\n\nError in the installation script for XCLASS package!")
+                print("\n\t" + ", ".join([LocalBuild[0] for LocalBuild in ListOfOutdatedBuilds]) + " has to be compiled, but")
+                print("\n\tcan not find " + " and ".join(ListOfWarnings) + " compiler!")
+                print("\n\tPlease install compiler and re-execute XCLASS installation script!\n\n")
+                sys.exit(0)
+            print("\nCan not find " + " and ".join(ListOfWarnings) + " compiler, but all components are up to date.")
 
 
-        ## compile MAGIX demo model programs and check, if compilation was successfully
-        print("\n\n\nCompile MAGIX demo model program ..\n\n")
-        MAGIXModelProgTestDIR = myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_general/bin/"
-        cmd_string = "rm -rf " + MAGIXModelProgTestDIR + "*.exe"
-        os.system(cmd_string)
-        # cmd_string = "cd " + myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_conv/; make all; "
-        cmd_string = "cd " + myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_general/; make all; cd " + myXCLASSDir
-        os.system(cmd_string)
-        ListOfFiles = os.listdir(MAGIXModelProgTestDIR)
-        CounterEXEFiles = 0
-        for LocalFile in ListOfFiles:
-            if (LocalFile.endswith(".exe")):
-                CounterEXEFiles += 1
-        if (CounterEXEFiles != 19):
-            print("\n\nError in the installation script for XCLASS package!")
-            print("\n\tThe compilation of the MAGIX demo model program failed!")
-            print("\n\tPlease take a look at the compiler messages!\n\n")
-            sys.exit(0)
+        ## with compilers, a component compiled by other compiler versions is out of date as well
+        else:
+            for LocalBuild in ListOfBuilds:
+                BuildKeys[LocalBuild[0]]["CompilerVersions"] = CompilerVersions
+            ListOfOutdatedBuilds = [LocalBuild for LocalBuild in ListOfBuilds if (LocalBuild in ListOfOutdatedBuilds \
+                                    or BuildCache.get(LocalBuild[0], {}).get("CompilerVersions") != CompilerVersions)]
+        for LocalBuild in ListOfBuilds:
+            if (not LocalBuild in ListOfOutdatedBuilds):
+                print("\n" + LocalBuild[0] + " is up to date, skip compilation.")
+
+
+        ## remove old executables and compile the outdated components side by side
+        if (ListOfOutdatedBuilds != []):
+            print("\n\n\nCompile " + ", ".join([LocalBuild[0] for LocalBuild in ListOfOutdatedBuilds]) \
+                  + " (" + str(NumberOfJobs) + " jobs) ..\n")
+        ListOfJobs = []
+        for LocalBuild in ListOfOutdatedBuilds:
+            if (os.path.isdir(LocalBuild[1])):
+                for LocalFile in os.listdir(LocalBuild[1]):
+                    if (LocalFile.endswith(".exe")):
+                        os.remove(LocalBuild[1] + LocalFile)
+            ListOfJobs.append([LocalBuild[0], LocalBuild[3] % NumberOfJobs, LocalBuild[4]])
+        if (ListOfJobs != []):
+            RunJobs(ListOfJobs, NumberOfJobs, BuildLogDir)
+
+
+        ## a makefile, which is not written for parallel make, may fail with more than one make job, compile failed builds once again
+        ## with a single make job
+        ListOfFailedBuilds = [LocalBuild for LocalBuild in ListOfOutdatedBuilds if (CountEXEFiles(LocalBuild[1]) != LocalBuild[2])]
+        if (ListOfFailedBuilds != [] and NumberOfJobs > 1):
+            print("\nCompile " + ", ".join([LocalBuild[0] for LocalBuild in ListOfFailedBuilds]) + " once again with a single make job ..\n")
+            ListOfJobs = [[LocalBuild[0], LocalBuild[3] % 1, LocalBuild[4]] for LocalBuild in ListOfFailedBuilds]
+            RunJobs(ListOfJobs, NumberOfJobs, BuildLogDir)
+            ListOfFailedBuilds = [LocalBuild for LocalBuild in ListOfFailedBuilds if (CountEXEFiles(LocalBuild[1]) != LocalBuild[2])]
+
+
+        ## update build cache: store the inputs of the successfully compiled components and forget the failed ones (the source hash is
+        ## computed once again, because a build may write source files, e.g. generated include files)
+        for LocalBuild in ListOfOutdatedBuilds:
+            if (LocalBuild in ListOfFailedBuilds):
+                BuildCache.pop(LocalBuild[0], None)
+            else:
+                BuildKeys[LocalBuild[0]]["SourceHash"] = GetSourceTreeHash(LocalBuild[6], LocalBuild[7])
+                BuildCache[LocalBuild[0]] = BuildKeys[LocalBuild[0]]
+        if (ListOfOutdatedBuilds != []):
+            WriteBuildCache(BuildCacheFileName, BuildCache)
 
 
-        ## compile MAGIX demo model programs and check, if compilation was successfully
-        print("\n\n\n\nCompile myXCLASS ..\n\n")
-        myXCLASSTestDIR = myXCLASSDir + "programs/myXCLASS/src/"
-        cmd_string = "rm -rf " + myXCLASSTestDIR + "*.exe"
-        os.system(cmd_string)
-        cmd_string = "cd " + myXCLASSDir + "programs/myXCLASS/src/; make all; cd ../../.."  ## compile myXCLASS
-        os.system(cmd_string)
-        ListOfFiles = os.listdir(myXCLASSTestDIR)
-        CounterEXEFiles = 0
-        for LocalFile in ListOfFiles:
-            if (LocalFile.endswith(".exe")):
-                CounterEXEFiles += 1
-        if (CounterEXEFiles != 1):
+        ## check, if compilation was successfully
+        if (ListOfFailedBuilds != []):
             print("\n\nError in the installation script for XCLASS package!")
-            print("\n\tThe compilation of the myXCLASS program failed!")
-            print("\n\tPlease take a look at the compiler messages!\n\n")
+            for LocalBuild in ListOfFailedBuilds:
+                print("\n\tThe compilation of " + LocalBuild[5] + " failed!")
+            print("\n\tPlease take a look at the compiler messages in")
+            for LocalBuild in ListOfFailedBuilds:
+                print("\n\t\t" + BuildLogDir + LocalBuild[0] + ".log")
+            print("\n\n")
             sys.exit(0)
 
 
@@ -442,7 +983,7 @@ if (__name__ == '__main__'):
     ##----------------------------------------------------------------------------------------------------------------------------------------------------
     ## modify the registration xml file for myXCLASS
     MAGIXRegXML = myXCLASSDir + "programs/MAGIX/Fit-Functions/myXCLASS/xml/myNewXCLASS.xml"
-    PathToStartScript = GetXMLtag(MAGIXRegXML, "PathStartScript")
+    PathToStartScript = GetXMLtagIndex(MAGIXRegXML).get("PathStartScript", [""])
     PathToStartScript = PathToStartScript[0].strip()
 
     # Debug:
@@ -462,19 +1003,15 @@ if (__name__ == '__main__'):
     # print "PathToStartScript = ", PathToStartScript
 
 
-    ## write new path to registration XML file
-    WriteXMLtag(MAGIXRegXML, "PathStartScript", PathToStartScript)
-
-
-    ## write path of current directory to the execution tag for myXCLASS program
+    ## write new path and path of current directory to the execution tag for myXCLASS program to registration XML file in one pass
     ExeCommandStartScriptTag = ["python start_myNewXCLASS.py " + myXCLASSDir]
-    WriteXMLtag(MAGIXRegXML, "ExeCommandStartScript", ExeCommandStartScriptTag)
+    WriteXMLtags(MAGIXRegXML, {"PathStartScript": PathToStartScript, "ExeCommandStartScript": ExeCommandStartScriptTag})
 
 
     ##----------------------------------------------------------------------------------------------------------------------------------------------------
     ## modify the registration xml file for conventional Drude Lorentz test model
     MAGIXRegXML = myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_conv/xml/Conventional_Drude-Lorentz.xml"
-    PathToStartScript = GetXMLtag(MAGIXRegXML, "PathStartScript")
+    PathToStartScript = GetXMLtagIndex(MAGIXRegXML).get("PathStartScript", [""])
     PathToStartScript = PathToStartScript[0].strip()
 
     # Debug:
@@ -495,13 +1032,13 @@ if (__name__ == '__main__'):
 
 
     ## write new path to registration XML file
-    WriteXMLtag(MAGIXRegXML, "PathStartScript", PathToStartScript)
+    WriteXMLtags(MAGIXRegXML, {"PathStartScript": PathToStartScript})
 
 
     ##----------------------------------------------------------------------------------------------------------------------------------------------------
     ## modify the registration xml file for generalized Drude Lorentz test model
     MAGIXRegXML = myXCLASSDir + "programs/MAGIX/Fit-Functions/Drude-Lorentz_general/xml/Generalized_Drude-Lorentz__sym__freq-damping+Rp.xml"
-    PathToStartScript = GetXMLtag(MAGIXRegXML, "PathStartScript")
+    PathToStartScript = GetXMLtagIndex(MAGIXRegXML).get("PathStartScript", [""])
     PathToStartScript = PathToStartScript[0].strip()
 
     # Debug:
@@ -522,33 +1059,25 @@ if (__name__ == '__main__'):
 
 
     ## write new path to registration XML file
-    WriteXMLtag(MAGIXRegXML, "PathStartScript", PathToStartScript)
+    WriteXMLtags(MAGIXRegXML, {"PathStartScript": PathToStartScript})
 
 
     ##----------------------------------------------------------------------------------------------------------------------------------------------------
     ## modifiy file task_myXCLASS.py: Include directory of XCLASS-interface directory
 
 
-    ## read in old directory to file
-    filename = "build_tasks/task_myXCLASS.py"
-    pythonFile = open(filename)
-    contents = pythonFile.readlines()
-    pythonFile.close()
-
-
-    ## write modified python file
-    pythonFile = open(filename, 'w')
-    for line in contents:
+    ## replace old directory in a single pass
+    def EditLine(line):
         if (line.find("XCLASSSystemRootDirectory =") > 0):
             newline = "    XCLASSSystemRootDirectory = " + chr(34) + myXCLASSDir + chr(34)
 
             # Debug:
             # print newline
 
-            pythonFile.write(newline + "\n")
-        else:
-            pythonFile.write(line)
-    pythonFile.close()
+            return newline + "\n"
+        return line
+    filename = "build_tasks/task_myXCLASS.py"
+    EditFileLines(filename, EditLine)
 
     # Debug:
     # print "myXCLASSDir = ", myXCLASSDir
@@ -668,14 +1197,48 @@ if (__name__ == '__main__'):
         # print 'ListOfFunctionNames = ', ListOfFunctionNames
 
 
-        ## execute buildmytasks shell script for each function
-        command_string = "cd " + casaHomeInstallationDir                                    ## go to CASA directory
-        os.system(command_string)
+        ## a <func>_Func.py file is up to date, if it exists and the task xml file, the task_<func>.py file and the buildmytasks script
+        ## of the current CASA installation are the same as for the last successful run of the buildmytasks script, which are stored
+        ## in the build cache
+        BuildCacheFileName = myXCLASSDir + "build_cache.json"
+        BuildCache = ReadBuildCache(BuildCacheFileName)
+        buildmytasksHash = GetFileHash(os.path.abspath(buildmytasksInstallationDir))
+        TaskKeys = {}
+        ListOfJobs = []
         for func in ListOfFunctionNames:                                                    ## loop over all function in the list ListOfFunctionNames
-            print("Execute buildmytasks shell script for " + func + " function ..",)
-            command_string = "cd " + myXCLASSDir + "build_tasks/; " + buildmytasksCommand + " " + func + " -o=" + func + "_Func.py; cd ../"
-            os.system(command_string)
-            print("done!")
+            TaskKeys[func] = {"TaskXMLHash": GetFileHash(myXCLASSDir + "build_tasks/" + func + ".xml"), \
+                              "TaskScriptHash": GetFileHash(myXCLASSDir + "build_tasks/task_" + func + ".py"), \
+                              "buildmytasksHash": buildmytasksHash}
+            if (RebuildFlag or BuildCache.get("buildmytasks_" + func) != TaskKeys[func] \
+                or not os.path.isfile(myXCLASSDir + "build_tasks/" + func + "_Func.py")):
+                command_string = buildmytasksCommand + " " + func + " -o=" + func + "_Func.py"
+                ListOfJobs.append(["buildmytasks_" + func, command_string, myXCLASSDir + "build_tasks/"])
+
+
+        ## execute buildmytasks shell script for each outdated function, NumberOfJobs functions at a time
+        JobResults = {}
+        if (ListOfJobs != []):
+            JobResults = RunJobs(ListOfJobs, NumberOfJobs, myXCLASSDir + "build_logs/")
+
+
+        ## print run time of each task and update build cache
+        print("\n\t%-22s %-12s %10s" % ("task", "status", "time [s]"))
+        for func in ListOfFunctionNames:
+            if (not ("buildmytasks_" + func) in JobResults):
+                print("\t%-22s %-12s %10s" % (func, "up to date", "-"))
+            elif (JobResults["buildmytasks_" + func][0] != 0):
+                BuildCache.pop("buildmytasks_" + func, None)
+                print("\t%-22s %-12s %10.1f" % (func, "failed", JobResults["buildmytasks_" + func][1]))
+            else:
+                BuildCache["buildmytasks_" + func] = TaskKeys[func]
+                print("\t%-22s %-12s %10.1f" % (func, "generated", JobResults["buildmytasks_" + func][1]))
+        if (JobResults != {}):
+            WriteBuildCache(BuildCacheFileName, BuildCache)
+        for func in ListOfFunctionNames:
+            if (("buildmytasks_" + func) in JobResults and JobResults["buildmytasks_" + func][0] != 0):
+                print("\n\nWARNING:\n")
+                print("\tThe buildmytasks shell script failed for " + func + " function!")
+                print("\tPlease take a look at " + myXCLASSDir + "build_logs/buildmytasks_" + func + ".log\n")
 
 
         ##================================================================================================================================================
@@ -683,6 +1246,10 @@ if (__name__ == '__main__'):
         print(" ")
 
 
+        ## define lines, which register the XCLASS tasks in CASA
+        XCLASSInitLines = GetInitLines(ListOfFunctionNames, myXCLASSDir, LazyFlag)
+
+
         ## does a init.py file already exsits, if not create new init.py file in .casa directory
         if not(os.path.isfile(HomeDir + "/.casa/init.py")):
             print("Create init.py file in " + HomeDir + "/.casa/ directory ..",)
@@ -691,15 +1258,14 @@ if (__name__ == '__main__'):
             ## create init.py file
             InitFile = open(HomeDir + "/.casa/init.py", 'w')
             InitFile.write("__rethrow_casa_exceptions=True\n")
-            for func in ListOfFunctionNames:
-                newline = "execfile(" + chr(34) + myXCLASSDir + "build_tasks/" + func + "_Func.py" + chr(34) + ")"
-                InitFile.write(newline + " \n")
+            for line in XCLASSInitLines:
+                InitFile.write(line)
             InitFile.close()
             print("done!")
             print("Now the myXCLASS for CASA interface is available when you start CASA without additional commands!")
 
 
-        ## if a init.py file already exsits, check if it contains the correct lines
+        ## if a init.py file already exsits, replace the lines of an earlier installation by the new ones
         else:
             print("Check init.py file in " + HomeDir + "/.casa/ directory ..",)
 
@@ -710,54 +1276,32 @@ if (__name__ == '__main__'):
             InitFile.close()
 
 
-            ## construct help array for line check routine
-            FunctionAlreadyAdded = []                                                       ## this list marks an already added execfile-line of a
-            for func in ListOfFunctionNames:                                                ## function
-                FunctionAlreadyAdded.append(0)
-
-
-            ## check if lines are correct
+            ## remove the XCLASS block and the execfile-lines of older installations, the new lines are inserted, where the first old
+            ## line was found
             NewContents = []                                                                ## reset new contents of init.py file
+            InsertPosition = (-1)                                                           ## position of the new lines in the new contents
+            InBlockFlag = False                                                             ## flag for lines within the XCLASS block
             for line in contents:                                                           ## loop over all lines in the init.py file
-                AddLineFlag = True                                                          ## flag for add current line to new content
-                counterFunc = 0                                                             ## reset counter for functions
-                for func in ListOfFunctionNames:                                            ## loop over all functions
-                    counterFunc += 1                                                        ## increase counter for functions
-                    if (line.find(func) > (-1)):                                            ## check, if current line contains a command for the current
-                                                                                            ## function
-                        # Debug:
-                        # print line.strip()
-
-                        if (FunctionAlreadyAdded[counterFunc - 1] == 0):                    ## check if this lines is not already added to new contents
-                            FunctionAlreadyAdded[counterFunc - 1] = 1
-                            newline = "execfile(" + chr(34) + myXCLASSDir + "build_tasks/" + func + "_Func.py" + chr(34) + ")\n"
-                            NewContents.append(newline)
-
-                            # Debug:
-                            # print 'counterFunc = ', counterFunc
-                            # print 'func = ', func
-                            # print 'FunctionAlreadyAdded = ', FunctionAlreadyAdded
-                            # print 'line = ', line.strip()
-                            # print 'newline = ', newline.strip()
-
-                        AddLineFlag = False
-                        # break
-
+                AddLineFlag = not InBlockFlag                                               ## flag for add current line to new content
+                if (line.strip() == XCLASSInitLines[0].strip()):
+                    InBlockFlag = True
+                    AddLineFlag = False
+                elif (line.strip() == XCLASSInitLines[-1].strip()):
+                    InBlockFlag = False
+                    AddLineFlag = False
+                else:
+                    for func in ListOfFunctionNames:                                        ## loop over all functions
+                        if (line.find("execfile(") > (-1) and line.find("/" + func + "_Func.py") > (-1)):
+                            AddLineFlag = False
                 if (AddLineFlag):
                     NewContents.append(line)
+                elif (InsertPosition == (-1)):
+                    InsertPosition = len(NewContents)
+            if (InsertPosition == (-1)):
+                InsertPosition = len(NewContents)
+            NewContents[InsertPosition:InsertPosition] = XCLASSInitLines
 
 
-            ## check, if all function calls are added
-            if (sum(FunctionAlreadyAdded) != len(FunctionAlreadyAdded)):
-                counterFunc = 0                                                             ## reset counter for functions
-                for func in ListOfFunctionNames:                                            ## loop over all functions
-                    counterFunc += 1                                                        ## increase counter for functions
-                    if (FunctionAlreadyAdded[counterFunc - 1] == 0):                        ## check if this lines is not already added to new contents
-                        FunctionAlreadyAdded[counterFunc - 1] = 1
-                        newline = "execfile(" + chr(34) + myXCLASSDir + "build_tasks/" + func + "_Func.py" + chr(34) + ")\n"
-                        NewContents.append(newline)
-                
-
             ## write new contents to file
             InitFile = open(HomeDir + "/.casa/init.py", 'w')
             # InitFile.write("__rethrow_casa_exceptions=True\n")
@@ -770,6 +1314,9 @@ if (__name__ == '__main__'):
             ## print a message to the screen
             # print "Add lines to init.py file in " + HomeDir + "/.casa/ directory.\n"
             print("Now the XCLASS interface is available whenever you start CASA without additional commands!\n\n")
+        if (LazyFlag):
+            print("The XCLASS tasks are loaded, when they are called for the first time.\n")
+        print("Start CASA with the environment variable XCLASS_STARTUP_TIME set to print the time used to register the XCLASS tasks.\n\n")
 
 
     ##----------------------------------------------------------------------------------------------------------------------------------------------------